@@ -6,12 +6,23 @@ from routes.tasks import router as tasks_router
 from routes.links import router as links_router
 from routes.calendar import router as calendar_router
 from routes.images import router as images_router
-from database import connect_db, disconnect_db
-from fastapi.responses import JSONResponse
+from routes.bootstrap import router as bootstrap_router
+from database import connect_db, disconnect_db, apply_schema_updates, request_loaders, RequestLoaders
+from passwords import calibrate_password_hasher, shutdown_password_pool
+from jobs import start_job_workers, stop_job_workers
+from profiler import ProfilerMiddleware
+from deadlines import DeadlineMiddleware
+from loop_monitor import start_loop_watchdog, stop_loop_watchdog
+from metrics import render_metrics
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.errors import ServerErrorMiddleware
 
 app = FastAPI()
 
+# On-demand request profiler; added first so it is the innermost middleware and
+# shares its task with the endpoint it samples
+app.add_middleware(ProfilerMiddleware)
+
 # Set allowed origins for CORS
 origins = [
     "http://localhost:3000",  # React app running on this address for local development
@@ -34,7 +45,11 @@ app.add_middleware(ServerErrorMiddleware, debug=True)
 @app.on_event("startup")
 async def startup():
     try:
+        await start_loop_watchdog()
         await connect_db()
+        await apply_schema_updates()
+        await calibrate_password_hasher()
+        await start_job_workers()
         logging.info("Database connection successful")
     except Exception as e:
         logging.error(f"Database connection failed: {e}")
@@ -44,10 +59,14 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     try:
+        await stop_job_workers()
         await disconnect_db()
+        shutdown_password_pool()
         logging.info("Database disconnected successfully")
     except Exception as e:
         logging.error(f"Error during database disconnection: {e}")
+    # Outside the handler above: in strict mode this raises BlockingCallError, which must fail the run
+    await stop_loop_watchdog()
 
 # Logging for request/response headers and preflight requests
 logging.basicConfig(level=logging.DEBUG)
@@ -70,6 +89,15 @@ async def log_requests(request, call_next):
     response.headers["Access-Control-Allow-Origin"] = "http://localhost:3000"
     return response
 
+# Give every request its own batching loaders so lookups are batched and memoized per request
+@app.middleware("http")
+async def attach_request_loaders(request, call_next):
+    token = request_loaders.set(RequestLoaders())
+    try:
+        return await call_next(request)
+    finally:
+        request_loaders.reset(token)
+
 # Global Exception Handler for detailed error messages and CORS response
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -86,6 +114,12 @@ app.include_router(users_router, prefix="/api/users")
 app.include_router(tasks_router, prefix="/api/tasks")
 app.include_router(calendar_router, prefix="/api/calendar")
 app.include_router(images_router, prefix="/api/images")
+app.include_router(bootstrap_router, prefix="/api/bootstrap")
+
+# Process metrics (event loop lag, blocking calls, ...) in Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_metrics()
 
 # For testing purposes: An example of handling CORS and making sure that the Access-Control-Allow-Origin header is present
 @app.get("/test-cors")
@@ -99,4 +133,10 @@ async def add_process_time_header(request, call_next):
         return response
     except Exception as e:
         logging.error(f"Error in processing: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Per-request latency budget, passed down to every query as its timeout; answers 504 when it is
+# spent and cancels the request when the client disconnects. Registered last so it is the
+# outermost middleware: the @app.middleware("http") layers above would otherwise fail with
+# "No response returned" when it cancels a request (the 504 bypasses CORSMiddleware, hence the header)
+app.add_middleware(DeadlineMiddleware, timeout_headers=[(b"access-control-allow-origin", b"http://localhost:3000")])
@@ -0,0 +1,48 @@
+# Benchmark of the query registry against the previous databases/SQLAlchemy path.
+# Run inside the fastapi container: python bench_queries.py --user-id 1 --iterations 2000
+import argparse
+import asyncio
+import time
+from database import database, connect_db, disconnect_db, fetch_one, fetch_all
+
+TASKS_BY_USER = """
+SELECT tasks.task_id, tasks.title, tasks.description, tasks.due_date, tasks.priority, tasks.status, tasks.created_at
+FROM tasks
+INNER JOIN links ON tasks.task_id = links.task_id
+WHERE links.user_id = :user_id
+"""
+USER_BY_ID = "SELECT * FROM users WHERE user_id = :user_id"
+
+async def databases_fetch_all(query, values):
+    return [dict(row) for row in await database.fetch_all(query=query, values=values)]
+
+async def databases_fetch_one(query, values):
+    row = await database.fetch_one(query=query, values=values)
+    return dict(row) if row is not None else None
+
+async def timed(label, fn, query, values, iterations):
+    await fn(query, values)  # warm up (connection, statement cache)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn(query, values)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {iterations / elapsed:>10.0f} queries/s  {elapsed / iterations * 1e6:>8.1f} us/query")
+
+async def main(user_id, iterations):
+    await connect_db()
+    try:
+        values = {"user_id": user_id}
+        async with database.connection():
+            await timed("tasks by user / databases + SQLAlchemy", databases_fetch_all, TASKS_BY_USER, values, iterations)
+            await timed("tasks by user / query registry", fetch_all, TASKS_BY_USER, values, iterations)
+            await timed("user by id / databases + SQLAlchemy", databases_fetch_one, USER_BY_ID, values, iterations)
+            await timed("user by id / query registry", fetch_one, USER_BY_ID, values, iterations)
+    finally:
+        await disconnect_db()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the query registry with the databases/SQLAlchemy path")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.iterations))
@@ -1,6 +1,17 @@
 from databases import Database
 from datetime import date
+from contextvars import ContextVar
+from contextlib import contextmanager
+from shards import ShardRing
+from deadlines import current_deadline, DeadlineExceeded
+import asyncio
+import asyncpg
+import functools
+import inspect
+import json
 import logging
+import os
+import re
 from fastapi import HTTPException
 from sqlalchemy import text
 from datetime import datetime
@@ -11,25 +22,519 @@ POSTGRES_DB = "advcompro"
 POSTGRES_HOST = "db"
 
 DATABASE_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}'
-database = Database(DATABASE_URL)
 
-# Database connection
+# Shard map: {"<shard number>": "<database url>"}; the first entry is the primary shard, which also
+# holds the job queue and allocates user ids. Shard numbers must stay below SHARD_ID_STRIDE and never
+# change, because they offset the id sequences that keep ids unique across shards.
+SHARD_MAP = json.loads(os.getenv("DATABASE_SHARDS", "null")) or {"0": DATABASE_URL}
+SHARD_ID_STRIDE = 64
+PRIMARY_SHARD = next(iter(SHARD_MAP))
+shard_databases = {name: Database(url) for name, url in SHARD_MAP.items()}
+shard_ring = ShardRing(shard_databases)
+database = shard_databases[PRIMARY_SHARD]
+
+current_shard = ContextVar("current_shard", default=PRIMARY_SHARD)
+
+# Route every query in the block (including ones issued from tasks started inside it) to a shard
+@contextmanager
+def use_shard(name: str):
+    token = current_shard.set(name)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+def use_user_shard(user_id: int):
+    return use_shard(shard_ring.shard_for(user_id))
+
+def get_database():
+    return shard_databases[current_shard.get()]
+
+# Decorator for per-user functions: run the function on the shard that owns its user_id argument
+def sharded_by_user(fn):
+    user_id_position = list(inspect.signature(fn).parameters).index("user_id")
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        user_id = kwargs["user_id"] if "user_id" in kwargs else args[user_id_position]
+        with use_user_shard(user_id):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+# Decorator for functions whose tables only live on the primary shard (the job queue)
+def on_primary_shard(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with use_shard(PRIMARY_SHARD):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+# Run fn on every shard concurrently and return the per-shard results (cross-user lookups)
+async def scatter_gather(fn, *args):
+    async def on_shard(name):
+        with use_shard(name):
+            return await fn(*args)
+    return await asyncio.gather(*(on_shard(name) for name in shard_databases))
+
+def first_found(results):
+    return next((result for result in results if result), None)
+
+# Name of the shard where `query` finds a row (for rows only known by their id), or None
+async def find_row_shard(query: str, values: dict):
+    found = await scatter_gather(fetch_val, query, values)
+    return next((name for name, result in zip(shard_databases, found) if result), None)
+
+# Query registry: every SQL text is compiled once from :named params to asyncpg's
+# positional $n form and run on the raw asyncpg connection, which prepares it once
+# per connection (asyncpg statement cache) instead of going through SQLAlchemy per call
+NAMED_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+STATEMENTS = {}
+
+class Statement:
+    def __init__(self, sql: str):
+        self.params = []
+        self.sql = NAMED_PARAM.sub(self._to_positional, sql)
+
+    def _to_positional(self, match):
+        name = match.group(1)
+        if name not in self.params:
+            self.params.append(name)
+        return f"${self.params.index(name) + 1}"
+
+    def args(self, values):
+        return [values[name] for name in self.params]
+
+def get_statement(sql: str):
+    statement = STATEMENTS.get(sql)
+    if statement is None:
+        statement = STATEMENTS[sql] = Statement(sql)
+    return statement
+
+# Row returned by the query layer: a plain dict that also allows row.column access
+class Row(dict):
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+async def run_statement(sql: str, values, method: str):
+    statement = get_statement(sql)
+    # connection() returns the connection of the current task (and its open transaction) on the current shard
+    async with get_database().connection() as connection:
+        raw_connection = connection.raw_connection
+        deadline = current_deadline.get()
+        if deadline is None:
+            return await getattr(raw_connection, method)(statement.sql, *statement.args(values or {}))
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            deadline.expire()
+            raise DeadlineExceeded()
+        try:
+            # When the budget runs out asyncpg sends Postgres a cancel request for the statement, so the
+            # server stops working on it too, without an extra SET statement_timeout round trip per query
+            return await getattr(raw_connection, method)(statement.sql, *statement.args(values or {}), timeout=remaining)
+        except (asyncpg.exceptions.QueryCanceledError, asyncio.TimeoutError):
+            deadline.expire()
+            raise DeadlineExceeded()
+
+async def fetch_one(sql: str, values: dict = None):
+    record = await run_statement(sql, values, "fetchrow")
+    return Row(record.items()) if record is not None else None
+
+async def fetch_all(sql: str, values: dict = None):
+    records = await run_statement(sql, values, "fetch")
+    return [Row(record.items()) for record in records]
+
+async def fetch_val(sql: str, values: dict = None):
+    return await run_statement(sql, values, "fetchval")
+
+async def execute(sql: str, values: dict = None):
+    return await run_statement(sql, values, "execute")
+
+# Database connection (every shard)
 async def connect_db():
     try:
-        await database.connect()
-        logging.info("Database connected successfully.")
+        await asyncio.gather(*(shard.connect() for shard in shard_databases.values()))
+        logging.info(f"Database connected successfully ({len(shard_databases)} shard(s)).")
     except Exception as e:
         logging.error(f"Error connecting to the database: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to connect to the database.")
 
+# Schema updates applied on startup; every statement must be safe to re-run
+SCHEMA_UPDATES = [
+    # links carries a copy of the task's due_date so a user's calendar window is one index range scan
+    "ALTER TABLE links ADD COLUMN IF NOT EXISTS due_date DATE",
+    """
+    UPDATE links SET due_date = tasks.due_date
+    FROM tasks
+    WHERE links.task_id = tasks.task_id AND links.due_date IS DISTINCT FROM tasks.due_date
+    """,
+    "CREATE INDEX IF NOT EXISTS links_user_id_due_date_idx ON links (user_id, due_date)",
+    # Background job queue, claimed by workers with FOR UPDATE SKIP LOCKED
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id BIGSERIAL PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        max_attempts INT NOT NULL DEFAULT 5,
+        run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        locked_at TIMESTAMPTZ,
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (job_type, run_at) WHERE status = 'queued'",
+    # Archive of completed tasks, range partitioned by created_at with one partition per month.
+    # Archive tables mirror their hot table column for column, so a column added to tasks,
+    # links or calendar must be added to its archive table in the same order.
+    "CREATE TABLE IF NOT EXISTS tasks_archive (LIKE tasks) PARTITION BY RANGE (created_at)",
+    "CREATE TABLE IF NOT EXISTS tasks_archive_default PARTITION OF tasks_archive DEFAULT",
+    "CREATE INDEX IF NOT EXISTS tasks_archive_task_id_idx ON tasks_archive (task_id)",
+    "CREATE TABLE IF NOT EXISTS links_archive (LIKE links)",
+    "CREATE INDEX IF NOT EXISTS links_archive_user_id_due_date_idx ON links_archive (user_id, due_date)",
+    "CREATE TABLE IF NOT EXISTS calendar_archive (LIKE calendar)",
+    "CREATE INDEX IF NOT EXISTS tasks_status_created_at_idx ON tasks (status, created_at)",
+    """
+    CREATE OR REPLACE FUNCTION ensure_tasks_archive_partition(month DATE) RETURNS VOID AS $$
+    BEGIN
+        -- Attaching a partition locks tasks_archive, so only do it when the partition is missing
+        IF to_regclass('tasks_archive_' || to_char(month, 'YYYY_MM')) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF tasks_archive FOR VALUES FROM (%L) TO (%L)',
+                'tasks_archive_' || to_char(month, 'YYYY_MM'),
+                date_trunc('month', month)::date,
+                (date_trunc('month', month) + interval '1 month')::date
+            );
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Delta sync: every task/link write takes a number from change_seq (the sync cursor).
+    # links carries the change number because a task is visible to a user through its link,
+    # so one index range scan finds everything that changed for a user since a cursor.
+    # The number is taken by a trigger (below) so no write path can take it without the lock.
+    "CREATE SEQUENCE IF NOT EXISTS change_seq",
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+    "ALTER TABLE tasks ALTER COLUMN updated_at SET DEFAULT NOW()",
+    "UPDATE tasks SET updated_at = created_at WHERE updated_at IS NULL",
+    "ALTER TABLE tasks_archive ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+    "ALTER TABLE links ADD COLUMN IF NOT EXISTS change_id BIGINT",
+    "ALTER TABLE links ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+    "ALTER TABLE links ALTER COLUMN updated_at SET DEFAULT NOW()",
+    "UPDATE links SET change_id = nextval('change_seq'), updated_at = NOW() WHERE change_id IS NULL",
+    "ALTER TABLE links_archive ADD COLUMN IF NOT EXISTS change_id BIGINT",
+    "ALTER TABLE links_archive ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS links_user_id_change_id_idx ON links (user_id, change_id)",
+    """
+    CREATE TABLE IF NOT EXISTS task_tombstones (
+        task_id INT NOT NULL,
+        user_id INT NOT NULL,
+        change_id BIGINT NOT NULL,
+        operation TEXT NOT NULL DEFAULT 'delete',  -- or 'archive': the task moved to tasks_archive
+        deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    # Change numbers are handed out under a per-user transaction-level lock held until commit, so a
+    # user's changes become visible in change order: a cursor (which is per user) can never move past
+    # a change that is still committing. Writers take these locks as their last step, so only the
+    # commit tail of concurrent writes for the same user is serialized.
+    """
+    CREATE OR REPLACE FUNCTION take_change_id() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('change_seq'), NEW.user_id);
+        NEW.change_id := nextval('change_seq');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # Statements touching several users take all their locks up front in user_id order (the locks
+    # are re-entrant, so the trigger then gets them for free); this keeps two writers from deadlocking
+    """
+    CREATE OR REPLACE FUNCTION lock_user_changes(user_ids INT[]) RETURNS VOID AS $$
+    DECLARE
+        locked_user_id INT;
+    BEGIN
+        FOREACH locked_user_id IN ARRAY COALESCE((SELECT array_agg(DISTINCT id ORDER BY id) FROM unnest(user_ids) AS id), '{}') LOOP
+            PERFORM pg_advisory_xact_lock(hashtext('change_seq'), locked_user_id);
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'links_take_change_id') THEN
+            CREATE TRIGGER links_take_change_id BEFORE INSERT OR UPDATE ON links
+            FOR EACH ROW EXECUTE FUNCTION take_change_id();
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'task_tombstones_take_change_id') THEN
+            CREATE TRIGGER task_tombstones_take_change_id BEFORE INSERT ON task_tombstones
+            FOR EACH ROW EXECUTE FUNCTION take_change_id();
+        END IF;
+    END;
+    $$
+    """,
+    "CREATE INDEX IF NOT EXISTS task_tombstones_user_id_change_id_idx ON task_tombstones (user_id, change_id)",
+    # Tombstones are kept for a retention window; cursors from before the newest pruned tombstone
+    # (sync_horizon.pruned_through) could have missed deletes and must sync again from scratch
+    "CREATE INDEX IF NOT EXISTS task_tombstones_deleted_at_idx ON task_tombstones (deleted_at)",
+    "CREATE TABLE IF NOT EXISTS sync_horizon (pruned_through BIGINT NOT NULL)",
+    "INSERT INTO sync_horizon (pruned_through) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM sync_horizon)",
+    # Shard names the stored data was placed with (kept on the primary shard), see check_shard_placement
+    "CREATE TABLE IF NOT EXISTS shard_map (shard_name TEXT PRIMARY KEY)",
+    # Sharding: user ids come from the primary shard's user_id_seq; row ids of the other sharded
+    # tables are kept unique across shards by stepping every shard's sequence by SHARD_ID_STRIDE
+    # from an offset equal to its shard number, starting above the largest id stored on any shard
+    "CREATE SEQUENCE IF NOT EXISTS user_id_seq",
+    """
+    CREATE OR REPLACE FUNCTION stride_id_sequence(table_name TEXT, column_name TEXT, stride INT, shard_offset INT, max_id BIGINT) RETURNS VOID AS $$
+    DECLARE
+        sequence_name TEXT := pg_get_serial_sequence(table_name, column_name);
+        last_id BIGINT;
+    BEGIN
+        IF sequence_name IS NULL THEN
+            RETURN;
+        END IF;
+        EXECUTE format('SELECT last_value FROM %s', sequence_name) INTO last_id;
+        EXECUTE format('ALTER SEQUENCE %s INCREMENT BY %s', sequence_name, stride);
+        PERFORM setval(sequence_name, (GREATEST(max_id, last_id) / stride + 1) * stride + shard_offset, false);
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# Tables whose ids are generated per shard and must not collide across shards
+SHARDED_ID_COLUMNS = [("tasks", "task_id"), ("calendar", "calendar_id"), ("images", "image_id")]
+
+async def apply_shard_schema_updates():
+    for statement in SCHEMA_UPDATES:
+        await execute(statement)
+
+# Archived rows keep their ids, so they count when picking where the sequences continue
+ARCHIVE_TABLES = {"tasks": "tasks_archive", "calendar": "calendar_archive"}
+
+async def max_stored_id(table_name: str, column_name: str):
+    tables = [table_name] + ([ARCHIVE_TABLES[table_name]] if table_name in ARCHIVE_TABLES else [])
+    maxima = ", ".join(f"(SELECT COALESCE(MAX({column_name}), 0) FROM {table})" for table in tables)
+    return await fetch_val(f"SELECT GREATEST({maxima})")
+
+async def stride_id_sequence_on_shard(table_name: str, column_name: str, max_id: int):
+    values = {
+        "table_name": table_name,
+        "column_name": column_name,
+        "stride": SHARD_ID_STRIDE,
+        "shard_offset": int(current_shard.get()),
+        "max_id": max_id
+    }
+    await fetch_val("SELECT stride_id_sequence(:table_name, :column_name, :stride, :shard_offset, :max_id)", values)
+
+# Every shard continues above the largest id stored on any shard (like sync_user_id_sequence):
+# rows moved to another shard keep their ids, so a per-shard maximum could hand them out again
+async def stride_id_sequences():
+    for table_name, column_name in SHARDED_ID_COLUMNS:
+        max_id = max(await scatter_gather(max_stored_id, table_name, column_name))
+        await scatter_gather(stride_id_sequence_on_shard, table_name, column_name, max_id)
+
+# Move the primary's user_id_seq past every user id already stored on any shard
+async def sync_user_id_sequence():
+    max_ids = await scatter_gather(fetch_val, "SELECT COALESCE(MAX(user_id), 0) FROM users")
+    with use_shard(PRIMARY_SHARD):
+        await fetch_val(
+            "SELECT setval('user_id_seq', GREATEST(:max_id, (SELECT last_value FROM user_id_seq)))",
+            {"max_id": max(max_ids)}
+        )
+
+# Users are placed by the ring, so changing the shard set re-homes most existing user_ids to shards
+# that hold none of their rows. When the configured shards differ from the ones the data was
+# placed with, every stored user is checked against the new ring and startup is refused if any
+# would be looked up on the wrong shard (their rows have to be moved first).
+async def check_shard_placement():
+    with use_shard(PRIMARY_SHARD):
+        stored = {row["shard_name"] for row in await fetch_all("SELECT shard_name FROM shard_map")}
+    if stored == set(shard_databases):
+        return
+
+    user_ids = await scatter_gather(fetch_all, "SELECT user_id FROM users")
+    misplaced = [
+        (row["user_id"], name, shard_ring.shard_for(row["user_id"]))
+        for name, rows in zip(shard_databases, user_ids)
+        for row in rows
+        if shard_ring.shard_for(row["user_id"]) != name
+    ]
+    if misplaced:
+        examples = ", ".join(f"user {user_id} on shard {name} (ring: {expected})" for user_id, name, expected in misplaced[:5])
+        raise RuntimeError(
+            f"Shard map changed from {sorted(stored)} to {sorted(shard_databases)} and {len(misplaced)} "
+            f"user(s) are not on the shard the ring maps them to, e.g. {examples}. Move their rows first."
+        )
+
+    with use_shard(PRIMARY_SHARD):
+        async with get_database().transaction():
+            await execute("DELETE FROM shard_map")
+            await execute("INSERT INTO shard_map (shard_name) SELECT unnest(CAST(:names AS TEXT[]))", {"names": list(shard_databases)})
+    logging.info(f"Shard map recorded: {sorted(shard_databases)}")
+
+async def apply_schema_updates():
+    try:
+        await scatter_gather(apply_shard_schema_updates)
+        if len(shard_databases) > 1:
+            await stride_id_sequences()
+            await sync_user_id_sequence()
+        await check_shard_placement()
+        logging.info("Database schema is up to date.")
+    except Exception as e:
+        logging.error(f"Error applying schema updates: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to apply schema updates.")
+
 # Database disconnection
 async def disconnect_db():
     try:
-        await database.disconnect()
+        await asyncio.gather(*(shard.disconnect() for shard in shard_databases.values()))
         logging.info("Database disconnected successfully.")
     except Exception as e:
         logging.error(f"Error disconnecting from the database: {str(e)}")
 
+# Batching loader: collects every load() issued in the same event-loop tick and
+# resolves them with a single batch query, memoizing the results afterwards
+class BatchLoader:
+    def __init__(self, batch_fn):
+        self.batch_fn = batch_fn  # async fn(list of keys) -> dict of key -> value
+        self.cache = {}
+        self.queue = []
+        self.dispatches = set()  # running dispatch tasks, referenced until they finish
+
+    # Every caller gets its own shielded view of the shared future, so a caller being
+    # cancelled does not cancel the result for the others (or poison the cache)
+    def load(self, key):
+        if key in self.cache:
+            return asyncio.shield(self.cache[key])
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.cache[key] = future
+        self.queue.append((key, future))
+        if len(self.queue) == 1:
+            # Dispatch once the callbacks already scheduled for this tick have run
+            loop.call_soon(self.start_dispatch)
+        return asyncio.shield(future)
+
+    def start_dispatch(self):
+        task = asyncio.get_running_loop().create_task(self.dispatch())
+        self.dispatches.add(task)
+        task.add_done_callback(self.dispatches.discard)
+
+    def clear(self, key):
+        self.cache.pop(key, None)
+
+    async def dispatch(self):
+        batch, self.queue = self.queue, []
+        keys = [key for key, _ in batch]
+        try:
+            results = await self.batch_fn(keys)
+        except Exception as e:
+            for key, future in batch:
+                self.cache.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch:
+            if not future.done():
+                future.set_result(results.get(key))
+
+async def _fetch_tasks_by_ids(task_ids):
+    query = """
+    SELECT task_id, title, description, due_date, priority, status, created_at
+    FROM tasks
+    WHERE task_id = ANY(:ids)
+    """
+    rows = await fetch_all(query, {"ids": task_ids})
+    return {row["task_id"]: dict(row) for row in rows}
+
+async def _fetch_users_by_ids(user_ids):
+    query = "SELECT * FROM users WHERE user_id = ANY(:ids)"
+    rows = await fetch_all(query, {"ids": user_ids})
+    return {row["user_id"]: dict(row) for row in rows}
+
+async def _fetch_owners_by_task_ids(task_ids):
+    query = "SELECT task_id, user_id FROM links WHERE task_id = ANY(:ids)"
+    rows = await fetch_all(query, {"ids": task_ids})
+    owners = {task_id: [] for task_id in task_ids}
+    for row in rows:
+        owners[row["task_id"]].append(row["user_id"])
+    return owners
+
+async def _fetch_calendar_entries_by_task_ids(task_ids):
+    query = """
+    SELECT calendar_id, user_id, task_id, created_at
+    FROM calendar
+    WHERE task_id = ANY(:ids)
+    """
+    rows = await fetch_all(query, {"ids": task_ids})
+    entries = {task_id: [] for task_id in task_ids}
+    for row in rows:
+        entries[row["task_id"]].append(dict(row))
+    return entries
+
+# Loaders of one shard; a batch is always dispatched on the shard of the loader that queued it
+class ShardLoaders:
+    def __init__(self):
+        self.tasks = BatchLoader(_fetch_tasks_by_ids)
+        self.users = BatchLoader(_fetch_users_by_ids)
+        self.task_owners = BatchLoader(_fetch_owners_by_task_ids)
+        self.calendar_entries = BatchLoader(_fetch_calendar_entries_by_task_ids)
+
+# One set of loaders per request (and shard), so memoized rows never leak between requests
+class RequestLoaders(dict):
+    def for_shard(self, name):
+        loaders = self.get(name)
+        if loaders is None:
+            loaders = self[name] = ShardLoaders()
+        return loaders
+
+request_loaders = ContextVar("request_loaders", default=None)
+
+# Return the current shard's loaders of the current request (created lazily outside of a request)
+def get_loaders():
+    loaders = request_loaders.get()
+    if loaders is None:
+        loaders = RequestLoaders()
+        request_loaders.set(loaders)
+    return loaders.for_shard(current_shard.get())
+
+# Function to select a task by task_id (batched per request)
+async def get_task_by_id(task_id: int):
+    try:
+        return await get_loaders().tasks.load(task_id)
+    except Exception as e:
+        logging.error(f"Error fetching task {task_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch task: {str(e)}")
+
+# Function to select a user by user_id (batched per request)
+@sharded_by_user
+async def get_user_by_id(user_id: int):
+    try:
+        return await get_loaders().users.load(user_id)
+    except Exception as e:
+        logging.error(f"Error fetching user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch user: {str(e)}")
+
+# Function to get the user_ids a task is linked to (batched per request)
+async def get_task_owner_ids(task_id: int):
+    try:
+        return await get_loaders().task_owners.load(task_id) or []
+    except Exception as e:
+        logging.error(f"Error fetching links for task {task_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch task links: {str(e)}")
+
+# Function to check whether a task is linked to a user
+@sharded_by_user
+async def is_task_linked_to_user(task_id: int, user_id: int):
+    return user_id in await get_task_owner_ids(task_id)
+
 # Function to insert a new user into the users table
 async def insert_user(username: str, password_hash: str, email: str):
     query = """
@@ -37,51 +542,75 @@ async def insert_user(username: str, password_hash: str, email: str):
     VALUES (:username, :password_hash, :email)
     RETURNING user_id, username, password_hash, email, created_at
     """
+    # With several shards the id is allocated first, since it decides which shard stores the user
+    sharded_query = """
+    INSERT INTO users (user_id, username, password_hash, email)
+    VALUES (:user_id, :username, :password_hash, :email)
+    RETURNING user_id, username, password_hash, email, created_at
+    """
     values = {"username": username, "password_hash": password_hash, "email": email}
     try:
-        return await database.fetch_one(query=query, values=values)
+        if len(shard_databases) == 1:
+            return await fetch_one(query, values)
+        with use_shard(PRIMARY_SHARD):
+            user_id = await fetch_val("SELECT nextval('user_id_seq')")
+        with use_user_shard(user_id):
+            return await fetch_one(sharded_query, {**values, "user_id": user_id})
     except Exception as e:
         logging.error(f"Error inserting user {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to insert user: {str(e)}")
 
-# Function to select a user by username
+# Function to select a user by username (searched on every shard)
 async def get_user(username: str):
     query = "SELECT * FROM users WHERE username = :username"
     try:
-        return await database.fetch_one(query=query, values={"username": username})
+        return first_found(await scatter_gather(fetch_one, query, {"username": username}))
     except Exception as e:
         logging.error(f"Error fetching user {username}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch user: {str(e)}")
 
-# Function to select a user by email and password_hash
-async def get_user_by_email(email: str, password_hash: str):
-    query = "SELECT * FROM users WHERE email = :email and password_hash = :password_hash"
+# Function to select a user by email (searched on every shard; the password is verified by the caller)
+async def get_user_by_email(email: str):
+    query = "SELECT * FROM users WHERE email = :email"
     try:
-        return await database.fetch_one(query=query, values={"email": email, "password_hash": password_hash})
+        return first_found(await scatter_gather(fetch_one, query, {"email": email}))
     except Exception as e:
         logging.error(f"Error fetching user by email {email}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch user: {str(e)}")
 
 # Function to update a user in the users table
+@sharded_by_user
 async def update_user(user_id: int, username: str, password_hash: str, email: str):
     query = """
     UPDATE users
-    SET username = :username, password_hash = :password_hash, email = :email
+    SET username = :username, password_hash = COALESCE(:password_hash, password_hash), email = :email
     WHERE user_id = :user_id
     RETURNING user_id, username, password_hash, email, created_at
     """
     values = {"user_id": user_id, "username": username, "password_hash": password_hash, "email": email}
     try:
-        return await database.fetch_one(query=query, values=values)
+        return await fetch_one(query, values)
     except Exception as e:
         logging.error(f"Error updating user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update user: {str(e)}")
 
+# Function to replace a user's stored password hash (used to rehash on login)
+@sharded_by_user
+async def update_password_hash(user_id: int, password_hash: str):
+    query = "UPDATE users SET password_hash = :password_hash WHERE user_id = :user_id"
+    try:
+        await execute(query, {"user_id": user_id, "password_hash": password_hash})
+        get_loaders().users.clear(user_id)
+    except Exception as e:
+        logging.error(f"Error updating password hash for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to update password hash: {str(e)}")
+
 # Function to delete a user from the users table
+@sharded_by_user
 async def delete_user(user_id: int):
     query = "DELETE FROM users WHERE user_id = :user_id RETURNING *"
     try:
-        return await database.fetch_one(query=query, values={"user_id": user_id})
+        return await fetch_one(query, {"user_id": user_id})
     except Exception as e:
         logging.error(f"Error deleting user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to delete user: {str(e)}")
@@ -107,7 +636,7 @@ async def insert_task(title: str, description: str, due_date: date, priority: st
         due_date = validate_due_date(due_date)
 
         # Insert task into DB
-        result = await database.fetch_one(query=query, values=values)
+        result = await fetch_one(query, values)
         if result:
             logging.debug(f"Inserted task: {dict(result)}")
             return dict(result)  # Ensure returning as dict to avoid Record object issues
@@ -160,17 +689,26 @@ async def create_task_endpoint(task_data):
 
 
 
-# Function to get tasks for a specific user
-async def get_tasks_by_user(user_id: int):
+# Function to get tasks for a specific user (optionally including archived tasks)
+@sharded_by_user
+async def get_tasks_by_user(user_id: int, include_archived: bool = False):
     query = """
     SELECT tasks.task_id, tasks.title, tasks.description, tasks.due_date, tasks.priority, tasks.status, tasks.created_at
     FROM tasks
     INNER JOIN links ON tasks.task_id = links.task_id
     WHERE links.user_id = :user_id
     """
+    archived_query = query + """
+    UNION ALL
+    SELECT tasks_archive.task_id, tasks_archive.title, tasks_archive.description, tasks_archive.due_date,
+           tasks_archive.priority, tasks_archive.status, tasks_archive.created_at
+    FROM tasks_archive
+    INNER JOIN links_archive ON tasks_archive.task_id = links_archive.task_id
+    WHERE links_archive.user_id = :user_id
+    """
     try:
         logging.debug(f"Fetching tasks for user {user_id}")
-        result = await database.fetch_all(query=query, values={"user_id": user_id})
+        result = await fetch_all(archived_query if include_archived else query, {"user_id": user_id})
 
         tasks = [dict(task) for task in result]
         
@@ -180,27 +718,33 @@ async def get_tasks_by_user(user_id: int):
         logging.error(f"Error fetching tasks for user {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch tasks: {str(e)}")
 
+@sharded_by_user
 async def update_task(task_id: int, user_id: int, title: str, description: str, due_date: date, priority: str, status: str):
     # Validate that the task exists for the user before updating
-    task_exists_query = """
-    SELECT tasks.task_id FROM tasks
-    INNER JOIN links ON tasks.task_id = links.task_id
-    WHERE tasks.task_id = :task_id AND links.user_id = :user_id
-    """
+    task, task_linked = await asyncio.gather(
+        get_task_by_id(task_id),
+        is_task_linked_to_user(task_id, user_id)
+    )
     
-    task_exists = await database.fetch_one(query=task_exists_query, values={"task_id": task_id, "user_id": user_id})
-    
-    if not task_exists:
+    if not task or not task_linked:
         logging.error(f"Task {task_id} not found for user {user_id}")
         raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found for user {user_id}")
 
     # Proceed with the update if the task exists
     query = """
     UPDATE tasks
-    SET title = :title, description = :description, due_date = :due_date, priority = :priority, status = :status
+    SET title = :title, description = :description, due_date = :due_date, priority = :priority, status = :status,
+        updated_at = NOW()
     WHERE task_id = :task_id
     RETURNING task_id, title, description, due_date, priority, status, created_at  -- Ensure created_at is included
     """
+    # Keep the due_date copy used by the calendar window index in sync and publish the change to sync
+    # clients; this is the transaction's last step because it takes the change locks of the task's users
+    lock_query = "SELECT lock_user_changes(ARRAY(SELECT user_id FROM links WHERE task_id = :task_id))"
+    links_query = """
+    UPDATE links SET due_date = :due_date, updated_at = NOW()
+    WHERE task_id = :task_id
+    """
     
     values = {
         "task_id": task_id,
@@ -213,7 +757,11 @@ async def update_task(task_id: int, user_id: int, title: str, description: str,
 
     try:
         logging.debug(f"Updating task {task_id} for user {user_id} with values: {values}")
-        updated_task = await database.fetch_one(query=query, values=values)
+        async with get_database().transaction():
+            updated_task = await fetch_one(query, values)
+            await fetch_val(lock_query, {"task_id": task_id})
+            await execute(links_query, {"task_id": task_id, "due_date": due_date})
+        get_loaders().tasks.clear(task_id)
         logging.debug(f"Task {task_id} updated successfully for user {user_id}")
         return updated_task  # Ensure this includes all necessary fields for response
     except Exception as e:
@@ -221,27 +769,86 @@ async def update_task(task_id: int, user_id: int, title: str, description: str,
         raise HTTPException(status_code=500, detail=f"Failed to update task: {str(e)}")
 
 
+# Task changes for a user after `cursor`, in change order: upserts for tasks created, modified or
+# newly linked, and deletes/archives from tombstones. Change numbers are taken under a lock held
+# until commit (take_change_id), so every change numbered below a returned one is already visible.
+@sharded_by_user
+async def get_task_changes(user_id: int, cursor: int, limit: int):
+    query = """
+    SELECT * FROM (
+        SELECT links.change_id, 'upsert' AS operation, tasks.task_id, tasks.title, tasks.description,
+               tasks.due_date, tasks.priority, tasks.status, tasks.created_at, tasks.updated_at
+        FROM links
+        INNER JOIN tasks ON tasks.task_id = links.task_id
+        WHERE links.user_id = :user_id AND links.change_id > :cursor
+        UNION ALL
+        -- A full sync (cursor 0) starts from nothing, so it has no use for tombstones
+        SELECT change_id, operation, task_id, NULL, NULL, NULL, NULL, NULL, NULL, deleted_at
+        FROM task_tombstones
+        WHERE user_id = :user_id AND change_id > :cursor AND :cursor > 0
+    ) changes
+    ORDER BY change_id
+    LIMIT :limit
+    """
+    values = {"user_id": user_id, "cursor": cursor, "limit": limit}
+    try:
+        return await fetch_all(query, values)
+    except Exception as e:
+        logging.error(f"Error fetching task changes for user {user_id} since {cursor}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch task changes: {str(e)}")
+
+# Newest change number whose tombstone may have been pruned; older cursors need a full sync
+@sharded_by_user
+async def get_pruned_change_id(user_id: int):
+    try:
+        return await fetch_val("SELECT pruned_through FROM sync_horizon") or 0
+    except Exception as e:
+        logging.error(f"Error fetching the sync horizon for user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch task changes: {str(e)}")
+
+# Drop up to `batch_size` tombstones older than `retention_days` on the current shard and move
+# the sync horizon past them; returns the number of tombstones dropped
+async def prune_task_tombstones(retention_days: int, batch_size: int):
+    query = """
+    WITH pruned AS (
+        DELETE FROM task_tombstones
+        WHERE change_id IN (
+            SELECT change_id FROM task_tombstones
+            WHERE deleted_at < NOW() - make_interval(days => :retention_days)
+            LIMIT :batch_size
+        )
+        RETURNING change_id
+    )
+    UPDATE sync_horizon SET pruned_through = GREATEST(pruned_through, (SELECT COALESCE(MAX(change_id), 0) FROM pruned))
+    RETURNING (SELECT COUNT(*) FROM pruned)
+    """
+    try:
+        pruned = await fetch_val(query, {"retention_days": retention_days, "batch_size": batch_size})
+        if pruned:
+            logging.info(f"Pruned {pruned} task tombstones")
+        return pruned
+    except Exception as e:
+        logging.error(f"Error pruning task tombstones: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to prune task tombstones: {str(e)}")
+
 # Function to link a task to a user in the links table
+@sharded_by_user
 async def link_task_to_user(task_id: int, user_id: int):
     # Check if the link already exists
-    check_query = """
-    SELECT * FROM links WHERE task_id = :task_id AND user_id = :user_id
-    """
-    existing_link = await database.fetch_one(query=check_query, values={"task_id": task_id, "user_id": user_id})
-    
-    if existing_link:
+    if await is_task_linked_to_user(task_id, user_id):
         raise HTTPException(status_code=400, detail="Task is already linked to the user.")
     
     # Proceed with linking if no link exists
     query = """
-    INSERT INTO links (task_id, user_id)
-    VALUES (:task_id, :user_id)
+    INSERT INTO links (task_id, user_id, due_date)
+    SELECT :task_id, :user_id, due_date FROM tasks WHERE task_id = :task_id
     RETURNING task_id, user_id
     """
     values = {"task_id": task_id, "user_id": user_id}
     
     try:
-        result = await database.fetch_one(query=query, values=values)
+        result = await fetch_one(query, values)
+        get_loaders().task_owners.clear(task_id)
         logging.debug(f"Task {task_id} linked to user {user_id}")
         return result
     except Exception as e:
@@ -251,16 +858,107 @@ async def link_task_to_user(task_id: int, user_id: int):
 
 
 
+# Move up to `batch_size` completed tasks older than `age_days` (with their links and
+# calendar entries) into the archive tables, creating archive partitions as needed
+async def archive_completed_tasks(age_days: int, batch_size: int):
+    months_query = """
+    SELECT DISTINCT date_trunc('month', created_at)::date AS month
+    FROM (
+        SELECT created_at FROM tasks
+        WHERE status = 'Complete' AND created_at < NOW() - make_interval(days => :age_days)
+        ORDER BY task_id
+        LIMIT :batch_size
+    ) AS batch
+    """
+    candidates_query = """
+    SELECT task_id
+    FROM tasks
+    WHERE status = 'Complete' AND created_at < NOW() - make_interval(days => :age_days)
+      AND date_trunc('month', created_at)::date = ANY(:months)
+    ORDER BY task_id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+    """
+    partition_query = "SELECT ensure_tasks_archive_partition(:month)"
+    move_links_query = """
+    WITH moved AS (DELETE FROM links WHERE task_id = ANY(:ids) RETURNING *),
+    archived AS (INSERT INTO links_archive SELECT * FROM moved)
+    SELECT task_id, user_id FROM moved
+    """
+    move_calendar_query = """
+    WITH moved AS (DELETE FROM calendar WHERE task_id = ANY(:ids) RETURNING *)
+    INSERT INTO calendar_archive SELECT * FROM moved
+    """
+    move_tasks_query = """
+    WITH moved AS (DELETE FROM tasks WHERE task_id = ANY(:ids) RETURNING *)
+    INSERT INTO tasks_archive SELECT * FROM moved
+    """
+    values = {"age_days": age_days, "batch_size": batch_size}
+    try:
+        # Partitions are created up front, each in its own short transaction, so the lock that
+        # attaching one takes on tasks_archive is not held (and blocking readers) for the whole batch.
+        # The batch then only takes tasks whose partition exists; the rest wait for the next run.
+        months = [row["month"] for row in await fetch_all(months_query, values)]
+        for month in months:
+            await fetch_val(partition_query, {"month": month})
+        if not months:
+            return 0
+        async with get_database().transaction():
+            candidates = await fetch_all(candidates_query, {**values, "months": months})
+            if not candidates:
+                return 0
+            task_ids = [row["task_id"] for row in candidates]
+            moved_links = await fetch_all(move_links_query, {"ids": task_ids})
+            await execute(move_calendar_query, {"ids": task_ids})
+            await execute(move_tasks_query, {"ids": task_ids})
+            # Sync clients get an "archive" tombstone for every link that left the live tables
+            await insert_tombstones(moved_links, "archive")
+        logging.info(f"Archived {len(task_ids)} completed tasks")
+        return len(task_ids)
+    except Exception as e:
+        logging.error(f"Error archiving completed tasks: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to archive tasks: {str(e)}")
+
+# Write sync tombstones for removed links (rows with task_id and user_id). Inserting them takes the
+# users' change locks, so callers do it as the last step of their transaction.
+async def insert_tombstones(links, operation: str):
+    if not links:
+        return
+    lock_query = "SELECT lock_user_changes(CAST(:user_ids AS INT[]))"
+    query = """
+    INSERT INTO task_tombstones (task_id, user_id, operation)
+    SELECT task_id, user_id, :operation
+    FROM unnest(CAST(:task_ids AS INT[]), CAST(:user_ids AS INT[])) AS removed (task_id, user_id)
+    """
+    task_ids = [link["task_id"] for link in links]
+    user_ids = [link["user_id"] for link in links]
+    await fetch_val(lock_query, {"user_ids": user_ids})
+    await execute(query, {"task_ids": task_ids, "user_ids": user_ids, "operation": operation})
+
 # Function to delete a task from the tasks table
 async def delete_task(task_id: int):
     query = "DELETE FROM tasks WHERE task_id = :task_id RETURNING *"
+    unlink_query = "DELETE FROM links WHERE task_id = :task_id RETURNING task_id, user_id"
+
+    async def delete_on_shard():
+        async with get_database().transaction():
+            removed_links = await fetch_all(unlink_query, {"task_id": task_id})
+            result = await fetch_one(query, {"task_id": task_id})
+            # Leave a tombstone for every user the task was linked to so sync clients learn about the delete
+            await insert_tombstones(removed_links, "delete")
+        get_loaders().tasks.clear(task_id)
+        get_loaders().task_owners.clear(task_id)
+        return result
+
     try:
-        return await database.fetch_one(query=query, values={"task_id": task_id})
+        # Only the task id is known, so the delete runs on every shard (ids are unique across shards)
+        return first_found(await scatter_gather(delete_on_shard))
     except Exception as e:
         logging.error(f"Error deleting task {task_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to delete task: {str(e)}")
 
 # Insert a new calendar entry
+@sharded_by_user
 async def insert_calendar_entry(user_id: int, task_id: int):
     query = """
     INSERT INTO calendar (user_id, task_id)
@@ -269,7 +967,9 @@ async def insert_calendar_entry(user_id: int, task_id: int):
     """
     values = {"user_id": user_id, "task_id": task_id}
     try:
-        return await database.fetch_one(query=query, values=values)
+        result = await fetch_one(query, values)
+        get_loaders().calendar_entries.clear(task_id)
+        return result
     except IntegrityError as e:
         logging.error(f"Integrity error inserting calendar entry for user {user_id} and task {task_id}: {str(e)}")
         raise HTTPException(status_code=409, detail="Duplicate calendar entry detected")
@@ -278,6 +978,7 @@ async def insert_calendar_entry(user_id: int, task_id: int):
         raise HTTPException(status_code=500, detail=f"Failed to insert calendar entry: {str(e)}")
 
 # Get calendar entries by user
+@sharded_by_user
 async def get_calendar_entries(user_id: int):
     query = """
     SELECT calendar_id, user_id, task_id, created_at
@@ -286,24 +987,51 @@ async def get_calendar_entries(user_id: int):
     """
     try:
         # Fetch the entries from the database
-        return await database.fetch_all(query=query, values={"user_id": user_id})
+        return await fetch_all(query, {"user_id": user_id})
     except Exception as e:
         logging.error(f"Error fetching calendar entries for user {user_id}: {str(e)}")
         raise
 
-# Get a calendar entry by user and task (to check for duplicates)
-async def get_calendar_entry_by_user_and_task(user_id: int, task_id: int):
+# Get a user's tasks due within [start_date, end_date], ordered by day (served by links_user_id_due_date_idx)
+@sharded_by_user
+async def get_tasks_in_window(user_id: int, start_date: date, end_date: date, include_archived: bool = False):
     query = """
-    SELECT calendar_id FROM calendar
-    WHERE user_id = :user_id AND task_id = :task_id
+    SELECT links.due_date, tasks.task_id, tasks.title, tasks.priority, tasks.status
+    FROM links
+    INNER JOIN tasks ON tasks.task_id = links.task_id
+    WHERE links.user_id = :user_id AND links.due_date BETWEEN :start_date AND :end_date
+    ORDER BY links.due_date, tasks.task_id
+    """
+    archived_query = """
+    SELECT links.due_date, tasks.task_id, tasks.title, tasks.priority, tasks.status
+    FROM links
+    INNER JOIN tasks ON tasks.task_id = links.task_id
+    WHERE links.user_id = :user_id AND links.due_date BETWEEN :start_date AND :end_date
+    UNION ALL
+    SELECT links_archive.due_date, tasks_archive.task_id, tasks_archive.title, tasks_archive.priority, tasks_archive.status
+    FROM links_archive
+    INNER JOIN tasks_archive ON tasks_archive.task_id = links_archive.task_id
+    WHERE links_archive.user_id = :user_id AND links_archive.due_date BETWEEN :start_date AND :end_date
+    ORDER BY due_date, task_id
     """
+    values = {"user_id": user_id, "start_date": start_date, "end_date": end_date}
     try:
-        return await database.fetch_one(query=query, values={"user_id": user_id, "task_id": task_id})
+        return await fetch_all(archived_query if include_archived else query, values)
+    except Exception as e:
+        logging.error(f"Error fetching tasks for user {user_id} between {start_date} and {end_date}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch calendar window: {str(e)}")
+
+# Get a calendar entry by user and task (to check for duplicates, batched per request)
+@sharded_by_user
+async def get_calendar_entry_by_user_and_task(user_id: int, task_id: int):
+    try:
+        entries = await get_loaders().calendar_entries.load(task_id) or []
+        return next((entry for entry in entries if entry["user_id"] == user_id), None)
     except Exception as e:
         logging.error(f"Error fetching calendar entry for user {user_id} and task {task_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch calendar entry: {str(e)}")
 
-# Update a calendar entry
+# Update a calendar entry on the shard that stores it; entries cannot move to a user on another shard
 async def update_calendar_entry(calendar_id: int, user_id: int, task_id: int):
     query = """
     UPDATE calendar
@@ -313,7 +1041,15 @@ async def update_calendar_entry(calendar_id: int, user_id: int, task_id: int):
     """
     values = {"calendar_id": calendar_id, "user_id": user_id, "task_id": task_id}
     try:
-        return await database.fetch_one(query=query, values=values)
+        shard = await find_row_shard("SELECT 1 FROM calendar WHERE calendar_id = :calendar_id", {"calendar_id": calendar_id})
+        if shard is None:
+            return None
+        if shard != shard_ring.shard_for(user_id):
+            raise HTTPException(status_code=409, detail=f"Calendar entry {calendar_id} cannot be reassigned to user {user_id}, who is stored on another shard")
+        with use_shard(shard):
+            return await fetch_one(query, values)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error updating calendar entry {calendar_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update calendar entry: {str(e)}")
@@ -324,7 +1060,7 @@ async def delete_calendar_entry(calendar_id: int):
     DELETE FROM calendar WHERE calendar_id = :calendar_id RETURNING *
     """
     try:
-        return await database.fetch_one(query=query, values={"calendar_id": calendar_id})
+        return first_found(await scatter_gather(fetch_one, query, {"calendar_id": calendar_id}))
     except Exception as e:
         logging.error(f"Error deleting calendar entry {calendar_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to delete calendar entry: {str(e)}")
@@ -346,6 +1082,7 @@ def validate_due_date(due_date: date):
     return due_date
 
 # Insert image into the database as binary data
+@sharded_by_user
 async def insert_image(user_id: int, image_data: bytes):
     query = """
     INSERT INTO images (user_id, image_data, uploaded_at)
@@ -354,16 +1091,17 @@ async def insert_image(user_id: int, image_data: bytes):
     """
     values = {"user_id": user_id, "image_data": image_data}
     try:
-        return await database.fetch_one(query=query, values=values)
+        return await fetch_one(query, values)
     except Exception as e:
         logging.error(f"Error inserting image: {str(e)}")
         raise Exception("Failed to insert image")
 
 # Get images by user_id (without returning the binary data)
+@sharded_by_user
 async def get_images_by_user(user_id: int):
     query = "SELECT image_id, user_id, uploaded_at FROM images WHERE user_id = :user_id"
     try:
-        return await database.fetch_all(query=query, values={"user_id": user_id})
+        return await fetch_all(query, {"user_id": user_id})
     except Exception as e:
         logging.error(f"Error fetching images: {str(e)}")
         raise Exception("Failed to fetch images")
@@ -372,7 +1110,101 @@ async def get_images_by_user(user_id: int):
 async def delete_image(image_id: int):
     query = "DELETE FROM images WHERE image_id = :image_id RETURNING *"
     try:
-        return await database.fetch_one(query=query, values={"image_id": image_id})
+        return first_found(await scatter_gather(fetch_one, query, {"image_id": image_id}))
     except Exception as e:
         logging.error(f"Error deleting image: {str(e)}")
         raise Exception("Failed to delete image")
+
+# Queue a background job
+@on_primary_shard
+async def insert_job(job_type: str, payload: dict, max_attempts: int, delay_seconds: float = 0, unique: bool = False):
+    query = """
+    INSERT INTO jobs (job_type, payload, max_attempts, run_at)
+    VALUES (:job_type, CAST(:payload AS JSONB), :max_attempts, NOW() + make_interval(secs => :delay_seconds))
+    RETURNING job_id
+    """
+    # Only queue when no job of this type is pending (returns None otherwise)
+    unique_query = """
+    INSERT INTO jobs (job_type, payload, max_attempts, run_at)
+    SELECT :job_type, CAST(:payload AS JSONB), :max_attempts, NOW() + make_interval(secs => :delay_seconds)
+    WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE job_type = :job_type AND status IN ('queued', 'running'))
+    RETURNING job_id
+    """
+    values = {
+        "job_type": job_type,
+        "payload": json.dumps(payload, default=str),
+        "max_attempts": max_attempts,
+        "delay_seconds": float(delay_seconds)
+    }
+    try:
+        return await fetch_val(unique_query if unique else query, values)
+    except Exception as e:
+        logging.error(f"Error queueing {job_type} job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue job: {str(e)}")
+
+# Claim up to `limit` due jobs of one type; rows locked by other workers are skipped
+@on_primary_shard
+async def claim_jobs(job_type: str, limit: int):
+    query = """
+    UPDATE jobs
+    SET status = 'running', attempts = attempts + 1, locked_at = NOW()
+    WHERE job_id IN (
+        SELECT job_id FROM jobs
+        WHERE job_type = :job_type AND status = 'queued' AND run_at <= NOW()
+        ORDER BY run_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING job_id, job_type, payload, attempts, max_attempts
+    """
+    rows = await fetch_all(query, {"job_type": job_type, "limit": limit})
+    return [{**dict(row), "payload": json.loads(row["payload"])} for row in rows]
+
+# A claim is identified by the job's attempt number: a requeued job is claimed again with the
+# next attempt, so the functions below only touch the row while the caller's claim still holds
+
+# Refresh the claim of a running job so it is not requeued as stale; False once the claim is lost
+@on_primary_shard
+async def extend_job_claim(job_id: int, attempts: int):
+    query = """
+    UPDATE jobs SET locked_at = NOW()
+    WHERE job_id = :job_id AND attempts = :attempts AND status = 'running'
+    RETURNING job_id
+    """
+    return await fetch_val(query, {"job_id": job_id, "attempts": attempts}) is not None
+
+# Finished jobs are removed so the queue table stays small
+@on_primary_shard
+async def complete_job(job_id: int, attempts: int):
+    query = "DELETE FROM jobs WHERE job_id = :job_id AND attempts = :attempts AND status = 'running'"
+    await execute(query, {"job_id": job_id, "attempts": attempts})
+
+# Put a failed job back in the queue after `retry_in` seconds, or mark it failed for good
+@on_primary_shard
+async def fail_job(job_id: int, attempts: int, error: str, retry_in: float = None):
+    if retry_in is None:
+        query = """
+        UPDATE jobs SET status = 'failed', locked_at = NULL, last_error = :error
+        WHERE job_id = :job_id AND attempts = :attempts AND status = 'running'
+        """
+        values = {"job_id": job_id, "attempts": attempts, "error": error}
+    else:
+        query = """
+        UPDATE jobs
+        SET status = 'queued', locked_at = NULL, last_error = :error,
+            run_at = NOW() + make_interval(secs => :retry_in)
+        WHERE job_id = :job_id AND attempts = :attempts AND status = 'running'
+        """
+        values = {"job_id": job_id, "attempts": attempts, "error": error, "retry_in": float(retry_in)}
+    await execute(query, values)
+
+# Requeue jobs left running by a worker that died
+@on_primary_shard
+async def requeue_stale_jobs(stale_after_seconds: float):
+    query = """
+    UPDATE jobs SET status = 'queued', locked_at = NULL
+    WHERE status = 'running' AND locked_at < NOW() - make_interval(secs => :stale_after)
+    RETURNING job_id
+    """
+    rows = await fetch_all(query, {"stale_after": float(stale_after_seconds)})
+    return len(rows)
@@ -0,0 +1,130 @@
+from contextvars import ContextVar
+from metrics import inc_counter
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Latency budget of a request unless its route has its own entry below
+DEFAULT_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "10"))
+# Budgets by path prefix (longest prefix wins)
+ROUTE_BUDGETS = {
+    "/api/images/upload": 30.0,
+    "/api/users/login": 5.0,
+    "/api/users/create": 5.0,
+}
+# Clients may ask for another budget with this header, up to MAX_BUDGET_SECONDS
+BUDGET_HEADER = b"x-request-timeout-ms"
+MAX_BUDGET_SECONDS = 60.0
+
+class DeadlineExceeded(Exception):
+    pass
+
+# Deadline of the current request; the query layer turns the remaining time into each query's timeout
+class RequestDeadline:
+    def __init__(self, scope, budget):
+        self.scope = scope
+        self.expires_at = time.monotonic() + budget
+        self.exceeded = False
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expire(self):
+        if not self.exceeded:
+            self.exceeded = True
+            inc_counter("request_deadline_exceeded_total", route=route_label(self.scope))
+
+current_deadline = ContextVar("current_deadline", default=None)
+
+def route_budget(path, headers):
+    prefixes = [prefix for prefix in ROUTE_BUDGETS if path.startswith(prefix)]
+    budget = ROUTE_BUDGETS[max(prefixes, key=len)] if prefixes else DEFAULT_BUDGET_SECONDS
+    for name, value in headers:
+        if name == BUDGET_HEADER:
+            try:
+                budget = min(max(int(value) / 1000, 0.001), MAX_BUDGET_SECONDS)
+            except ValueError:
+                pass
+    return budget
+
+def route_label(scope):
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope["path"]
+
+# Pure ASGI middleware: runs the request in its own task under a deadline, cancels it (and the
+# query it is waiting on) when the client disconnects, and answers 504 once the deadline is blown
+class DeadlineMiddleware:
+    def __init__(self, app, timeout_headers=()):
+        self.app = app
+        self.timeout_headers = list(timeout_headers)  # extra headers of the 504 response
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        deadline = RequestDeadline(scope, route_budget(scope["path"], scope["headers"]))
+        token = current_deadline.set(deadline)
+        response_started = False
+        client_disconnected = False
+        messages = asyncio.Queue(maxsize=4)
+
+        async def receive_from_client():
+            if client_disconnected and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_unless_expired(message):
+            nonlocal response_started
+            if deadline.exceeded and not response_started:
+                return  # the 504 is sent instead once the request task ends
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            request_task = asyncio.create_task(self.app(scope, receive_from_client, send_unless_expired))
+        finally:
+            current_deadline.reset(token)
+
+        # Sole reader of the client's messages, so a disconnect is seen even while the app is busy
+        async def watch_client():
+            nonlocal client_disconnected
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    client_disconnected = True
+                    if not response_started:
+                        inc_counter("request_client_disconnects_total", route=route_label(scope))
+                        logging.info(f"Client disconnected, cancelling {scope['method']} {scope['path']}")
+                        request_task.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch_client())
+        try:
+            done, _ = await asyncio.wait({request_task}, timeout=max(deadline.remaining(), 0))
+            if not done:
+                deadline.expire()
+                request_task.cancel()
+                await asyncio.gather(request_task, return_exceptions=True)
+        except asyncio.CancelledError:
+            request_task.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if deadline.exceeded and not response_started:
+            await send_timeout(send, self.timeout_headers)
+        elif not request_task.cancelled():  # cancelled: the client went away, nobody is left to answer
+            request_task.result()  # re-raise errors of the app
+
+async def send_timeout(send, extra_headers=()):
+    body = json.dumps({"detail": "The request took too long and was cancelled."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 504,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers],
+    })
+    await send({"type": "http.response.body", "body": body})
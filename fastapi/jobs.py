@@ -0,0 +1,152 @@
+from database import insert_job, claim_jobs, extend_job_claim, complete_job, fail_job, requeue_stale_jobs
+import asyncio
+import logging
+import os
+import random
+
+POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+# Jobs still running after this long are assumed to belong to a dead worker
+STALE_JOB_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# Running jobs refresh their claim this often, so long jobs are never mistaken for stale ones
+CLAIM_REFRESH_SECONDS = STALE_JOB_SECONDS / 3
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 600.0
+SHUTDOWN_GRACE_SECONDS = 10.0
+
+# Registered job types: job_type -> JobType
+JOB_TYPES = {}
+
+class JobType:
+    def __init__(self, name, handler, concurrency, max_attempts, every_seconds):
+        self.name = name
+        self.handler = handler  # async fn(payload dict)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.every_seconds = every_seconds  # periodic jobs re-queue themselves after each run
+        self.wakeup = asyncio.Event()
+        self.running = set()
+
+# Decorator registering an async handler for a job type
+def job_handler(job_type: str, concurrency: int = 1, max_attempts: int = 5, every_seconds: float = None):
+    def register(fn):
+        JOB_TYPES[job_type] = JobType(job_type, fn, concurrency, max_attempts, every_seconds)
+        return fn
+    return register
+
+# Queue non-critical work; failures are logged instead of failing the calling request.
+# With unique=True nothing is queued while a job of the same type is already pending.
+async def enqueue_job(job_type: str, payload: dict, delay_seconds: float = 0, unique: bool = False):
+    job = JOB_TYPES.get(job_type)
+    if job is None:
+        logging.error(f"No handler registered for job type {job_type}")
+        return None
+    try:
+        job_id = await insert_job(job_type, payload, job.max_attempts, delay_seconds, unique)
+    except Exception as e:
+        logging.error(f"Could not queue {job_type} job with payload {payload}: {str(e)}")
+        return None
+    if not delay_seconds:
+        job.wakeup.set()
+    logging.debug(f"Queued {job_type} job {job_id}")
+    return job_id
+
+def retry_delay(attempts: int):
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+# Keep refreshing the claim while the handler runs; if another worker took the job over
+# (this one was stalled past STALE_JOB_SECONDS), stop the handler instead of running it twice
+async def keep_claim(job: dict, handler: asyncio.Task, claim: dict):
+    while True:
+        await asyncio.sleep(CLAIM_REFRESH_SECONDS)
+        try:
+            if not await extend_job_claim(job["job_id"], job["attempts"]):
+                logging.warning(f"Lost the claim on job {job['job_id']} (attempt {job['attempts']}), stopping it")
+                claim["lost"] = True
+                handler.cancel()
+                return
+        except Exception as e:
+            logging.error(f"Could not refresh the claim on job {job['job_id']}: {str(e)}")
+
+async def run_job(job_type: JobType, job: dict):
+    job_id = job["job_id"]
+    claim = {"lost": False}
+    handler = asyncio.create_task(job_type.handler(job["payload"]))
+    heartbeat = asyncio.create_task(keep_claim(job, handler, claim))
+    try:
+        await handler
+        await complete_job(job_id, job["attempts"])
+        logging.debug(f"{job_type.name} job {job_id} done")
+    except asyncio.CancelledError:
+        if not claim["lost"]:
+            raise
+        return  # the worker now holding the claim completes or fails the job
+    except Exception as e:
+        retry_in = retry_delay(job["attempts"]) if job["attempts"] < job["max_attempts"] else None
+        logging.error(f"{job_type.name} job {job_id} failed (attempt {job['attempts']}): {str(e)}")
+        try:
+            await fail_job(job_id, job["attempts"], str(e), retry_in)
+        except Exception as record_error:
+            logging.error(f"Could not record failure of job {job_id}: {str(record_error)}")
+        if retry_in is not None:
+            return
+    finally:
+        heartbeat.cancel()
+    if job_type.every_seconds:
+        await enqueue_job(job_type.name, job["payload"], delay_seconds=job_type.every_seconds, unique=True)
+
+# One poller per job type; it never holds more than `concurrency` jobs at once
+async def poll_jobs(job_type: JobType):
+    while True:
+        free_slots = job_type.concurrency - len(job_type.running)
+        claimed = []
+        if free_slots > 0:
+            try:
+                claimed = await claim_jobs(job_type.name, free_slots)
+            except Exception as e:
+                logging.error(f"Error claiming {job_type.name} jobs: {str(e)}")
+        for job in claimed:
+            task = asyncio.create_task(run_job(job_type, job))
+            job_type.running.add(task)
+            task.add_done_callback(lambda t: (job_type.running.discard(t), job_type.wakeup.set()))
+        # A full batch means more work may be waiting; otherwise sleep until woken or the next poll
+        if claimed and len(claimed) == free_slots:
+            continue
+        job_type.wakeup.clear()
+        try:
+            await asyncio.wait_for(job_type.wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def requeue_stale_jobs_periodically():
+    while True:
+        try:
+            requeued = await requeue_stale_jobs(STALE_JOB_SECONDS)
+            if requeued:
+                logging.info(f"Requeued {requeued} stale jobs")
+        except Exception as e:
+            logging.error(f"Error requeueing stale jobs: {str(e)}")
+        await asyncio.sleep(STALE_JOB_SECONDS)
+
+workers = []
+
+async def start_job_workers():
+    for job_type in JOB_TYPES.values():
+        if job_type.every_seconds:
+            await enqueue_job(job_type.name, {}, unique=True)
+        workers.append(asyncio.create_task(poll_jobs(job_type)))
+    workers.append(asyncio.create_task(requeue_stale_jobs_periodically()))
+    logging.info(f"Started job workers for: {', '.join(JOB_TYPES) or 'no job types'}")
+
+# Stop polling, then give in-flight jobs a short grace period before the database goes away
+async def stop_job_workers():
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
+    running = [task for job_type in JOB_TYPES.values() for task in job_type.running]
+    if running:
+        done, pending = await asyncio.wait(running, timeout=SHUTDOWN_GRACE_SECONDS)
+        for task in pending:
+            task.cancel()
+        logging.info(f"Stopped job workers ({len(pending)} jobs left to be requeued)")
@@ -0,0 +1,106 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from metrics import set_gauge, max_gauge, inc_counter
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("LOOP_HEARTBEAT_MS", "50")) / 1000
+# A callback holding the loop longer than this is reported as a blocking call
+BLOCKING_THRESHOLD_SECONDS = float(os.getenv("LOOP_BLOCKING_THRESHOLD_MS", "100")) / 1000
+# Strict mode (for tests) turns every blocking call over the threshold into a BlockingCallError
+STRICT_MODE = os.getenv("LOOP_WATCHDOG_STRICT", "0") == "1"
+# Outside strict mode only the most recent blocking calls are kept (they are also logged)
+MAX_KEPT_VIOLATIONS = 100
+
+class BlockingCallError(Exception):
+    pass
+
+# Measures event-loop lag with a heartbeat coroutine; a watchdog thread notices when the
+# heartbeat stops and dumps the loop thread's stack while it is still blocked
+class LoopWatchdog:
+    def __init__(self, threshold=BLOCKING_THRESHOLD_SECONDS, strict=STRICT_MODE):
+        self.threshold = threshold
+        self.strict = strict
+        self.violations = deque(maxlen=None if strict else MAX_KEPT_VIOLATIONS)  # (number, blocked seconds, stack text)
+        self.violation_count = 0
+        self.last_beat = time.monotonic()
+        self.captured_stack = None
+        self.stopped = threading.Event()
+
+    async def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        await asyncio.sleep(0)  # let the heartbeat arm its first timer, so a stall right after start is measured
+        self.thread = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopped.set()
+        self.heartbeat_task.cancel()
+        await asyncio.gather(self.heartbeat_task, return_exceptions=True)
+        if self.strict:
+            self.raise_for_violations()
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + HEARTBEAT_INTERVAL_SECONDS
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            now = time.monotonic()
+            lag = max(now - expected, 0)
+            self.last_beat = now
+            set_gauge("event_loop_lag_seconds", lag)
+            max_gauge("event_loop_lag_max_seconds", lag)
+            if lag > self.threshold:
+                self.record_blocking(lag)
+
+    def record_blocking(self, lag):
+        stack, self.captured_stack = self.captured_stack, None
+        stack = stack or "(stack not captured)"
+        self.violations.append((self.violation_count, lag, stack))
+        self.violation_count += 1
+        inc_counter("event_loop_blocking_calls_total")
+        logging.warning(f"Event loop blocked for {lag * 1000:.0f} ms (threshold {self.threshold * 1000:.0f} ms):\n{stack}")
+
+    # Runs in its own thread: snapshot the loop thread once per stall, while it is blocked
+    def watch(self):
+        captured_for = None
+        while not self.stopped.wait(self.threshold / 2):
+            last_beat = self.last_beat
+            stalled = time.monotonic() - last_beat > self.threshold + HEARTBEAT_INTERVAL_SECONDS
+            if stalled and captured_for != last_beat:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.captured_stack = "".join(traceback.format_stack(frame))
+                captured_for = last_beat
+
+    def raise_for_violations(self, since: int = 0):
+        violations = [violation for violation in self.violations if violation[0] >= since]
+        if violations:
+            _, lag, stack = max(violations, key=lambda violation: violation[1])
+            raise BlockingCallError(
+                f"{len(violations)} blocking call(s) over {self.threshold * 1000:.0f} ms, worst {lag * 1000:.0f} ms:\n{stack}"
+            )
+
+    # For tests: fail the enclosed block if the loop was blocked longer than the budget
+    @asynccontextmanager
+    async def budget(self):
+        since = self.violation_count
+        yield
+        # Let the heartbeat observe a stall that ended right at the end of the block
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS * 2)
+        self.raise_for_violations(since)
+
+watchdog = LoopWatchdog()
+
+async def start_loop_watchdog():
+    await watchdog.start()
+    logging.info(f"Event loop watchdog started (threshold {watchdog.threshold * 1000:.0f} ms, strict={watchdog.strict})")
+
+async def stop_loop_watchdog():
+    await watchdog.stop()
@@ -0,0 +1,40 @@
+import threading
+
+# Minimal in-process metrics registry, exposed in Prometheus text format at /metrics.
+# Safe to update from worker threads as well as the event loop.
+lock = threading.Lock()
+counters = {}
+gauges = {}
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc_counter(name: str, amount: float = 1, **labels):
+    key = metric_key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+def set_gauge(name: str, value: float, **labels):
+    with lock:
+        gauges[metric_key(name, labels)] = value
+
+def max_gauge(name: str, value: float, **labels):
+    key = metric_key(name, labels)
+    with lock:
+        gauges[key] = max(gauges.get(key, value), value)
+
+def format_sample(key, value):
+    name, labels = key
+    if labels:
+        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+def render_metrics():
+    with lock:
+        lines = []
+        for kind, samples in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({key[0] for key in samples}):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(format_sample(key, value) for key, value in sorted(samples.items()) if key[0] == name)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHashError, VerificationError
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hmac
+import logging
+import os
+import time
+
+# Hashing is CPU bound, so it runs in a small bounded pool instead of on the event loop
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Target latency of a single hash; the work factor is calibrated to it at startup
+HASH_TARGET_MS = int(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+HASH_MEMORY_COST = int(os.getenv("PASSWORD_HASH_MEMORY_KIB", "65536"))
+HASH_MAX_TIME_COST = 16
+
+executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+hasher = PasswordHasher(memory_cost=HASH_MEMORY_COST)
+
+# Run a blocking hashing call in the hashing pool
+async def run_in_pool(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, fn, *args)
+
+# Pick the smallest time_cost whose hash takes at least HASH_TARGET_MS on this machine
+def _calibrate():
+    time_cost = 1
+    while True:
+        candidate = PasswordHasher(time_cost=time_cost, memory_cost=HASH_MEMORY_COST)
+        started = time.perf_counter()
+        candidate.hash("calibration-password")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= HASH_TARGET_MS or time_cost >= HASH_MAX_TIME_COST:
+            return candidate, elapsed_ms
+        time_cost += 1
+
+async def calibrate_password_hasher():
+    global hasher
+    try:
+        hasher, elapsed_ms = await run_in_pool(_calibrate)
+        logging.info(f"Password hasher calibrated: time_cost={hasher.time_cost}, memory_cost={hasher.memory_cost}, {elapsed_ms:.0f} ms per hash")
+    except Exception as e:
+        logging.error(f"Password hasher calibration failed, keeping defaults: {str(e)}")
+
+def shutdown_password_pool():
+    executor.shutdown(wait=False)
+
+def is_legacy_hash(stored_hash: str):
+    return not stored_hash.startswith("$argon2")
+
+async def hash_password(password: str):
+    return await run_in_pool(hasher.hash, password)
+
+# Check that a stored hash uses at least the current work factor
+def _needs_rehash(stored_hash: str):
+    if is_legacy_hash(stored_hash):
+        return True
+    try:
+        params = extract_parameters(stored_hash)
+    except InvalidHashError:
+        return True
+    return params.time_cost < hasher.time_cost or params.memory_cost < hasher.memory_cost
+
+def _verify(stored_hash: str, password: str):
+    # A user without a stored hash cannot log in with any password
+    if not stored_hash:
+        return False
+    # Legacy rows stored the client-supplied value as is
+    if is_legacy_hash(stored_hash):
+        return hmac.compare_digest(stored_hash.encode(), password.encode())
+    try:
+        return hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+# Verify a password, returning (is_valid, needs_rehash)
+async def verify_password(stored_hash: str, password: str):
+    is_valid = await run_in_pool(_verify, stored_hash, password)
+    return is_valid, is_valid and _needs_rehash(stored_hash)
@@ -0,0 +1,122 @@
+import asyncio
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# Requests are profiled when they carry "X-Profile: <PROFILER_TOKEN>" or are picked by the sample rate
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL_SECONDS = float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", "profiles")
+
+# Awaits whose stack passes through these files count as time waiting on the database
+DB_MODULES = ("database.py", os.sep + "asyncpg" + os.sep, os.sep + "databases" + os.sep)
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+# Statistical profile of one request: a sampler thread periodically looks at the request's
+# task and records either the running Python stack or the chain of awaits it is suspended in
+class RequestProfile:
+    def __init__(self, task, loop_thread_id, output_path):
+        self.task = task
+        self.loop_thread_id = loop_thread_id
+        self.output_path = output_path
+        self.samples = Counter()
+        self.categories = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(PROFILER_INTERVAL_SECONDS):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.debug(f"Profiler sample failed: {str(e)}")
+        try:
+            self.write()
+        except Exception as e:
+            logging.error(f"Error writing profile {self.output_path}: {str(e)}")
+
+    def sample(self):
+        coro = self.task.get_coro()
+        if coro.cr_running:
+            # The request is executing Python code on the loop thread right now
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                if frame is coro.cr_frame:
+                    break
+                frame = frame.f_back
+            category = "python"
+            stack.reverse()
+        else:
+            # Suspended: follow the await chain down to the awaited future
+            stack = []
+            category = "await"
+            awaitable = coro
+            while getattr(awaitable, "cr_frame", None) is not None:
+                code = awaitable.cr_frame.f_code
+                stack.append(frame_name(code))
+                if any(module in code.co_filename for module in DB_MODULES):
+                    category = "db wait"
+                awaitable = awaitable.cr_await
+            stack.append(f"<await {type(awaitable).__name__}>")
+        self.categories[category] += 1
+        self.samples[";".join([f"[{category}]"] + stack)] += 1
+
+    # Collapsed-stack output ("frame;frame;frame count"), readable by speedscope and flamegraph.pl
+    def write(self):
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        with open(self.output_path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        total = sum(self.categories.values()) or 1
+        breakdown = ", ".join(f"{name} {count * 100 / total:.0f}%" for name, count in self.categories.most_common())
+        logging.info(f"Profile written to {self.output_path}: {self.elapsed * 1000:.1f} ms, {total} samples ({breakdown})")
+
+def should_profile(scope):
+    if PROFILER_TOKEN:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return hmac.compare_digest(value.decode("latin-1"), PROFILER_TOKEN)
+    return PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE
+
+# Pure ASGI middleware (not BaseHTTPMiddleware) so the endpoint runs in the task being sampled;
+# requests that are not profiled only pay for the header check
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        path = scope["path"].strip("/").replace("/", "_") or "root"
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{path}-{random.getrandbits(32):08x}.collapsed"
+        profile = RequestProfile(asyncio.current_task(), threading.get_ident(), os.path.join(PROFILER_OUTPUT_DIR, file_name))
+
+        async def send_with_profile_header(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-file", file_name.encode())]
+            await send(message)
+
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_header)
+        finally:
+            profile.stop()
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+from database import get_user_by_id, get_tasks_by_user, get_calendar_entries, get_images_by_user
+from routes.tasks import TaskResponse
+from routes.calendar import CalendarResponse
+from routes.images import ImageResponse
+import asyncio
+import logging
+
+# Initialize APIRouter instance
+router = APIRouter()
+
+# User section of the bootstrap payload (no password hash)
+class BootstrapUser(BaseModel):
+    user_id: int
+    username: str
+    email: str
+    created_at: datetime
+
+# Sections that were not asked for are left out of the response
+class BootstrapResponse(BaseModel):
+    user_id: int
+    user: Optional[BootstrapUser] = None
+    tasks: Optional[List[TaskResponse]] = None
+    calendar: Optional[List[CalendarResponse]] = None
+    images: Optional[List[ImageResponse]] = None
+
+# Loader of each section; every one runs on the user's shard
+SECTIONS = {
+    "user": lambda user_id, include_archived: get_user_by_id(user_id),
+    "tasks": lambda user_id, include_archived: get_tasks_by_user(user_id, include_archived),
+    "calendar": lambda user_id, include_archived: get_calendar_entries(user_id),
+    "images": lambda user_id, include_archived: get_images_by_user(user_id),
+}
+
+# Everything a page needs right after login in one round trip. The sections are loaded
+# concurrently: gather runs each in its own task, so each gets its own pooled connection.
+# "fields" is a comma-separated subset of the sections (default: all of them).
+@router.get("/{user_id}", response_model=BootstrapResponse, response_model_exclude_unset=True)
+async def bootstrap(user_id: int, fields: Optional[str] = None, include_archived: bool = False):
+    names = list(SECTIONS) if fields is None else [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SECTIONS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"fields must be a comma-separated subset of: {', '.join(SECTIONS)}")
+    names = list(dict.fromkeys(names))
+
+    try:
+        results = await asyncio.gather(*(SECTIONS[name](user_id, include_archived) for name in names))
+    except Exception as e:
+        logging.error(f"Error bootstrapping user {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to load user data")
+
+    payload = dict(zip(names, results))
+    if "user" in payload and payload["user"] is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": user_id, **payload}
@@ -1,15 +1,17 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List
-from datetime import datetime
+from typing import List, Optional
+from datetime import datetime, date, timedelta, MINYEAR, MAXYEAR
 from sqlalchemy.exc import IntegrityError
 from database import (
     insert_calendar_entry, 
     get_calendar_entries, 
     delete_calendar_entry,
     update_calendar_entry, 
-    get_calendar_entry_by_user_and_task  
+    get_calendar_entry_by_user_and_task,
+    get_tasks_in_window
 )
+from jobs import job_handler
 
 # Initialize APIRouter instance
 router = APIRouter()
@@ -29,6 +31,90 @@ class CalendarResponse(BaseModel):
     user_id: int
     created_at: datetime
 
+class CalendarTask(BaseModel):
+    task_id: int
+    title: str
+    priority: str
+    status: str
+
+class CalendarDay(BaseModel):
+    day: date
+    count: int
+    tasks: List[CalendarTask]
+
+class CalendarWindowResponse(BaseModel):
+    user_id: int
+    start_date: date
+    end_date: date
+    total: int
+    days: List[CalendarDay]
+
+# Background job: create the calendar entry for a task unless it already exists
+@job_handler("create_calendar_entry", concurrency=4)
+async def create_calendar_entry_job(payload):
+    user_id, task_id = payload["user_id"], payload["task_id"]
+    if await get_calendar_entry_by_user_and_task(user_id, task_id):
+        return
+    await insert_calendar_entry(user_id, task_id)
+
+# Largest window a single calendar view request may cover
+MAX_WINDOW_DAYS = 366
+
+# Endpoint to get a month (or any date window) as pre-bucketed days
+@router.get("/month/{user_id}", response_model=CalendarWindowResponse)
+async def read_calendar_window(
+    user_id: int,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    include_archived: bool = False
+):
+    if (start_date is None) != (end_date is None):
+        raise HTTPException(status_code=400, detail="start_date and end_date must be sent together")
+
+    # Default to the month given by year/month (or the current month) when no explicit window is sent
+    if start_date is None:
+        today = date.today()
+        year = today.year if year is None else year
+        month = today.month if month is None else month
+        if not MINYEAR <= year < MAXYEAR:
+            raise HTTPException(status_code=400, detail=f"Year must be between {MINYEAR} and {MAXYEAR - 1}")
+        if not 1 <= month <= 12:
+            raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+        start_date = date(year, month, 1)
+        end_date = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end_date - start_date).days >= MAX_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"Window cannot exceed {MAX_WINDOW_DAYS} days")
+
+    rows = await get_tasks_in_window(user_id, start_date, end_date, include_archived)
+
+    # Rows arrive ordered by due_date, so each day's bucket is filled in one pass
+    days = [
+        {"day": start_date + timedelta(days=offset), "count": 0, "tasks": []}
+        for offset in range((end_date - start_date).days + 1)
+    ]
+    for row in rows:
+        bucket = days[(row["due_date"] - start_date).days]
+        bucket["tasks"].append({
+            "task_id": row["task_id"],
+            "title": row["title"],
+            "priority": row["priority"],
+            "status": row["status"]
+        })
+        bucket["count"] += 1
+
+    return {
+        "user_id": user_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "total": len(rows),
+        "days": days
+    }
+
 # Endpoint to create a new calendar entry
 @router.post("/calendar", response_model=CalendarResponse)
 async def create_calendar_entry(entry: CalendarCreate):
@@ -39,7 +125,7 @@ async def create_calendar_entry(entry: CalendarCreate):
             raise HTTPException(status_code=409, detail="Calendar entry already exists for the specified user and task")
 
         # Insert the new calendar entry into the database and return the result
-        result = await insert_calendar_entry(entry.task_id, entry.user_id)
+        result = await insert_calendar_entry(user_id=entry.user_id, task_id=entry.task_id)
         if not result:
             raise HTTPException(status_code=400, detail="Error creating calendar entry")
         return result
@@ -64,10 +150,12 @@ async def read_calendar(user_id: int):
 async def update_calendar_entry_endpoint(calendar_id: int, entry: CalendarUpdate):
     try:
         # Update the existing calendar entry in the database
-        result = await update_calendar_entry(calendar_id, entry.task_id, entry.user_id)
+        result = await update_calendar_entry(calendar_id, user_id=entry.user_id, task_id=entry.task_id)
         if not result:
             raise HTTPException(status_code=404, detail="Calendar entry not found")
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import List
 from database import insert_image, get_images_by_user, delete_image
 import logging
+import traceback
 
 router = APIRouter()
 
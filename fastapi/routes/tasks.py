@@ -1,10 +1,13 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from datetime import datetime, date
-from database import insert_task, get_tasks_by_user, update_task, delete_task, link_task_to_user, database  # Import the database object
+from database import insert_task, get_tasks_by_user, update_task, delete_task, link_task_to_user, get_task_by_id, get_task_owner_ids, archive_completed_tasks, get_task_changes, get_pruned_change_id, prune_task_tombstones, use_shard, use_user_shard, shard_databases
+from jobs import enqueue_job, job_handler
 from fastapi.responses import JSONResponse
+import asyncio
 import logging
+import os
 
 # Initialize APIRouter instance
 router = APIRouter()
@@ -31,52 +34,98 @@ class LinkResponse(BaseModel):
     task_id: int
     user_id: int
 
+class TaskChange(BaseModel):
+    change_id: int
+    operation: str  # "upsert", "delete" or "archive"; the last two only carry task_id and updated_at
+    task_id: int
+    title: Optional[str]
+    description: Optional[str]
+    due_date: Optional[date]
+    priority: Optional[str]
+    status: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+class TaskChangesResponse(BaseModel):
+    changes: List[TaskChange]
+    cursor: int
+    has_more: bool
+
+# Completed tasks older than this are moved to the archive tables
+ARCHIVE_AFTER_DAYS = int(os.getenv("TASK_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("TASK_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# Periodic background job: archive old completed tasks on every shard in batches until none are left
+@job_handler("archive_tasks", every_seconds=ARCHIVE_INTERVAL_SECONDS)
+async def archive_tasks_job(payload):
+    for shard in shard_databases:
+        with use_shard(shard):
+            while await archive_completed_tasks(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE) == ARCHIVE_BATCH_SIZE:
+                pass
+
+# Delete/archive tombstones older than this are pruned; clients with an older cursor get a 410
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+
+# Periodic background job: prune expired sync tombstones on every shard
+@job_handler("prune_tombstones", every_seconds=ARCHIVE_INTERVAL_SECONDS)
+async def prune_tombstones_job(payload):
+    for shard in shard_databases:
+        with use_shard(shard):
+            while await prune_task_tombstones(TOMBSTONE_RETENTION_DAYS, ARCHIVE_BATCH_SIZE) == ARCHIVE_BATCH_SIZE:
+                pass
+
 # Endpoint to create a new task
 @router.post("/create")
 async def create_task(task: TaskCreate):
-    try:
-        logging.debug(f"Creating a new task for user {task.user_id} with title {task.title}")
+    # The task is stored on the shard of the user it is created for
+    with use_user_shard(task.user_id):
+        try:
+            logging.debug(f"Creating a new task for user {task.user_id} with title {task.title}")
         
-        # Insert the new task into the tasks table
-        new_task = await insert_task(
-            task.title, task.description, task.due_date, task.priority, task.status
-        )
-        if not new_task:
-            logging.error("Task insertion failed")
-            raise HTTPException(status_code=400, detail="Error creating task")
+            # Insert the new task into the tasks table
+            new_task = await insert_task(
+                task.title, task.description, task.due_date, task.priority, task.status
+            )
+            if not new_task:
+                logging.error("Task insertion failed")
+                raise HTTPException(status_code=400, detail="Error creating task")
 
-        logging.debug(f"Task inserted with ID: {new_task.get('task_id')}")
+            logging.debug(f"Task inserted with ID: {new_task.get('task_id')}")
 
-        # Link the new task to the user via the links table
-        task_id = new_task.get('task_id')
-        if not task_id:
-            logging.error("No task_id returned after insertion")
-            raise HTTPException(status_code=500, detail="Failed to retrieve task_id after creation")
+            # Link the new task to the user via the links table
+            task_id = new_task.get('task_id')
+            if not task_id:
+                logging.error("No task_id returned after insertion")
+                raise HTTPException(status_code=500, detail="Failed to retrieve task_id after creation")
 
-        link_success = await link_task_to_user(task_id, task.user_id)
-        if not link_success:
-            logging.error(f"Error linking task {task_id} to user {task.user_id}")
-            raise HTTPException(status_code=400, detail="Error linking task to user")
+            link_success = await link_task_to_user(task_id, task.user_id)
+            if not link_success:
+                logging.error(f"Error linking task {task_id} to user {task.user_id}")
+                raise HTTPException(status_code=400, detail="Error linking task to user")
 
-        logging.debug(f"Task {task_id} linked to user {task.user_id}")
-        return new_task
+            logging.debug(f"Task {task_id} linked to user {task.user_id}")
 
-    except Exception as e:
-        logging.error(f"Task creation error for user {task.user_id}: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": f"An internal error occurred: {str(e)}"},
-        )
+            # The calendar entry is not needed to answer the request, so it is created in the background
+            await enqueue_job("create_calendar_entry", {"user_id": task.user_id, "task_id": task_id})
+            return new_task
+
+        except Exception as e:
+            logging.error(f"Task creation error for user {task.user_id}: {str(e)}")
+            return JSONResponse(
+                status_code=500,
+                content={"detail": f"An internal error occurred: {str(e)}"},
+            )
 
 
 
 # Endpoint to get tasks by user ID
 @router.get("/fetch/{user_id}", response_model=List[TaskResponse])
-async def read_tasks(user_id: int):
+async def read_tasks(user_id: int, include_archived: bool = False):
     try:
         logging.debug(f"Fetching tasks for user {user_id}")
         
-        result = await get_tasks_by_user(user_id)
+        result = await get_tasks_by_user(user_id, include_archived)
         
         # If result is empty, return an empty list (not a 404)
         if result is None or len(result) == 0:
@@ -93,42 +142,59 @@ async def read_tasks(user_id: int):
         )
 
 
+# Page size limits of the delta-sync endpoint
+SYNC_DEFAULT_LIMIT = 200
+SYNC_MAX_LIMIT = 1000
+
+# Endpoint returning task changes after a cursor (0 for a full sync); pass the returned
+# cursor back on the next call and keep calling while has_more is true
+@router.get("/changes/{user_id}", response_model=TaskChangesResponse)
+async def read_task_changes(user_id: int, cursor: int = 0, limit: int = SYNC_DEFAULT_LIMIT):
+    if cursor < 0 or not 1 <= limit <= SYNC_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"cursor must be >= 0 and limit between 1 and {SYNC_MAX_LIMIT}")
+    # Deletes after this cursor may already be pruned, so the client has to start over
+    if cursor and cursor < await get_pruned_change_id(user_id):
+        raise HTTPException(status_code=410, detail="Cursor is older than the retained change history; sync again with cursor=0")
+
+    # One extra row tells whether another page follows
+    rows = await get_task_changes(user_id, cursor, limit + 1)
+    changes = rows[:limit]
+    return {
+        "changes": changes,
+        "cursor": changes[-1]["change_id"] if changes else cursor,
+        "has_more": len(rows) > limit
+    }
+
 # Endpoint to update a task
 @router.put("/update/{task_id}", response_model=TaskResponse)
 async def update_task_endpoint(task_id: int, task: TaskCreate):
-    try:
-        logging.debug(f"Updating task {task_id} for user {task.user_id}")
-        
-        # Fetch the specific task by task_id, not by user_id
-        existing_task_query = """
-        SELECT tasks.task_id, tasks.title, tasks.description, tasks.due_date, tasks.priority, tasks.status, tasks.created_at, links.user_id
-        FROM tasks
-        INNER JOIN links ON tasks.task_id = links.task_id
-        WHERE tasks.task_id = :task_id
-        """
+    with use_user_shard(task.user_id):
+        try:
+            logging.debug(f"Updating task {task_id} for user {task.user_id}")
         
-        existing_task = await database.fetch_one(query=existing_task_query, values={"task_id": task_id})
+            # Fetch the specific task and its owners by task_id; update_task reuses the memoized rows
+            existing_task, owner_ids = await asyncio.gather(get_task_by_id(task_id), get_task_owner_ids(task_id))
         
-        if not existing_task:
-            raise HTTPException(status_code=404, detail="Task not found")
+            if not existing_task or not owner_ids:
+                raise HTTPException(status_code=404, detail="Task not found")
         
-        if existing_task['user_id'] != task.user_id:
-            raise HTTPException(status_code=403, detail="Not authorized to update this task")
+            if task.user_id not in owner_ids:
+                raise HTTPException(status_code=403, detail="Not authorized to update this task")
         
-        # Update the task
-        updated_task = await update_task(task_id, task.user_id, task.title, task.description, task.due_date, task.priority, task.status)
-        if not updated_task:
-            raise HTTPException(status_code=404, detail="Task not found")
-
-        logging.debug(f"Task {task_id} updated successfully")
-        return updated_task
-
-    except Exception as e:
-        logging.error(f"Error updating task {task_id}: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": f"An internal error occurred while updating the task: {str(e)}"},
-        )
+            # Update the task
+            updated_task = await update_task(task_id, task.user_id, task.title, task.description, task.due_date, task.priority, task.status)
+            if not updated_task:
+                raise HTTPException(status_code=404, detail="Task not found")
+
+            logging.debug(f"Task {task_id} updated successfully")
+            return updated_task
+
+        except Exception as e:
+            logging.error(f"Error updating task {task_id}: {str(e)}")
+            return JSONResponse(
+                status_code=500,
+                content={"detail": f"An internal error occurred while updating the task: {str(e)}"},
+            )
 
 # Endpoint to delete a task
 @router.delete("/delete/{task_id}")
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 from database import *  # Ensure your database functions are imported
+from passwords import hash_password, verify_password
 
 
 router = APIRouter()
@@ -24,11 +25,10 @@ class UserUpdate(BaseModel):
    email: Optional[str]
 
 
-# Pydantic model for user response
+# Pydantic model for user response (never includes the stored password hash)
 class User(BaseModel):
    user_id: int
    username: str
-   password_hash: str
    email: str
    created_at: datetime
 
@@ -48,7 +48,8 @@ async def create_user(user: UserCreate):
        raise HTTPException(status_code=400, detail="Username already exists")
 
 
-   result = await insert_user(user.username, user.password_hash, user.email)
+   password_hash = await hash_password(user.password_hash)
+   result = await insert_user(user.username, password_hash, user.email)
    if result is None:
        raise HTTPException(status_code=400, detail="Error creating user")
    return result
@@ -68,7 +69,10 @@ async def read_user(user_id: int):
 # Endpoint to update a user
 @router.put("/put/{user_id}", response_model=User)
 async def update_user_endpoint(user_id: int, user: UserUpdate):
-   result = await update_user(user_id, user.username, user.password_hash, user.email)
+   password_hash = user.password_hash
+   if password_hash is not None:
+       password_hash = await hash_password(password_hash)
+   result = await update_user(user_id, user.username, password_hash, user.email)
    if result is None:
        raise HTTPException(status_code=404, detail="User not found")
    return result
@@ -87,11 +91,18 @@ async def delete_user_endpoint(user_id: int):
 @router.post("/login")
 async def login_user(user: UserLogin):
    # Fetch user from the database
-   db_user = await get_user_by_email(user.email,user.password_hash)
+   db_user = await get_user_by_email(user.email)
   
    if db_user is None:
        raise HTTPException(status_code=404, detail="User not found")
 
+   # Verify off the event loop; legacy or weaker hashes are upgraded transparently
+   is_valid, needs_rehash = await verify_password(db_user.password_hash, user.password_hash)
+   if not is_valid:
+       raise HTTPException(status_code=404, detail="User not found")
+   if needs_rehash:
+       await update_password_hash(db_user.user_id, await hash_password(user.password_hash))
+
 
    # If login is successful, you can return user info (omit password hash)
    return {
@@ -0,0 +1,24 @@
+from bisect import bisect
+import hashlib
+
+# Virtual nodes per shard; more nodes spread users more evenly across shards
+VIRTUAL_NODES = 128
+
+def ring_hash(key: str):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+# Consistent-hash ring mapping user_ids to shard names. Adding or removing a shard
+# only moves the users whose ring segment changed owner (about 1/N of them).
+class ShardRing:
+    def __init__(self, shard_names, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (ring_hash(f"{name}#{replica}"), name)
+            for name in shard_names
+            for replica in range(virtual_nodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.names = [name for _, name in points]
+
+    def shard_for(self, user_id: int):
+        index = bisect(self.hashes, ring_hash(str(user_id))) % len(self.hashes)
+        return self.names[index]
@@ -0,0 +1,61 @@
+from datetime import date, datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routes.bootstrap as bootstrap
+
+CREATED_AT = datetime(2024, 1, 2, 3, 4, 5)
+
+async def fake_user(user_id):
+    if user_id != 1:
+        return None
+    return {"user_id": 1, "username": "ada", "password_hash": "$argon2id$secret", "email": "ada@example.com", "created_at": CREATED_AT}
+
+async def fake_tasks(user_id, include_archived=False):
+    return [{
+        "task_id": 7, "title": "Write", "description": "Draft", "due_date": date(2024, 2, 1),
+        "priority": "High", "status": "Pending", "created_at": CREATED_AT
+    }]
+
+async def fake_calendar(user_id):
+    return [{"calendar_id": 3, "user_id": user_id, "task_id": 7, "created_at": CREATED_AT}]
+
+async def fake_images(user_id):
+    return [{"image_id": 5, "user_id": user_id, "uploaded_at": CREATED_AT}]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(bootstrap, "get_user_by_id", fake_user)
+    monkeypatch.setattr(bootstrap, "get_tasks_by_user", fake_tasks)
+    monkeypatch.setattr(bootstrap, "get_calendar_entries", fake_calendar)
+    monkeypatch.setattr(bootstrap, "get_images_by_user", fake_images)
+    app = FastAPI()
+    app.include_router(bootstrap.router, prefix="/api/bootstrap")
+    return TestClient(app)
+
+def test_all_sections_by_default(client):
+    response = client.get("/api/bootstrap/1")
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"user_id", "user", "tasks", "calendar", "images"}
+    assert "password_hash" not in body["user"]
+
+@pytest.mark.parametrize("fields, sections", [
+    ("tasks", {"tasks"}),
+    ("user,images", {"user", "images"}),
+    (" calendar , tasks,calendar", {"calendar", "tasks"}),
+])
+def test_field_selection_returns_only_requested_sections(client, fields, sections):
+    response = client.get("/api/bootstrap/1", params={"fields": fields})
+    assert response.status_code == 200
+    assert set(response.json()) == {"user_id"} | sections
+
+def test_unknown_field_is_rejected(client):
+    response = client.get("/api/bootstrap/1", params={"fields": "tasks,passwords"})
+    assert response.status_code == 400
+
+def test_missing_user_is_404(client):
+    assert client.get("/api/bootstrap/2").status_code == 404
+    assert client.get("/api/bootstrap/2", params={"fields": "tasks"}).status_code == 200
@@ -0,0 +1,75 @@
+import asyncio
+
+from deadlines import DeadlineMiddleware, current_deadline
+
+def make_scope(budget_ms):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/test",
+        "headers": [(b"x-request-timeout-ms", str(budget_ms).encode())],
+    }
+
+def run_request(app, budget_ms=100, disconnect_after=None, **middleware_options):
+    sent = []
+
+    async def main():
+        async def receive():
+            if disconnect_after is None:
+                await asyncio.Event().wait()  # the client stays connected
+            await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await DeadlineMiddleware(app, **middleware_options)(make_scope(budget_ms), receive, send)
+
+    asyncio.run(main())
+    return sent
+
+async def respond(send, status=200):
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+def test_fast_request_passes_through():
+    async def app(scope, receive, send):
+        assert current_deadline.get().remaining() > 0
+        await respond(send)
+
+    sent = run_request(app)
+    assert sent[0]["status"] == 200
+
+def test_slow_request_gets_504_with_extra_headers():
+    async def app(scope, receive, send):
+        await asyncio.sleep(1)
+        await respond(send)
+
+    sent = run_request(app, budget_ms=50, timeout_headers=[(b"access-control-allow-origin", b"http://localhost:3000")])
+    assert sent[0]["status"] == 504
+    assert (b"access-control-allow-origin", b"http://localhost:3000") in sent[0]["headers"]
+    assert len(sent) == 2
+
+def test_expired_deadline_replaces_error_response():
+    # Routes turn every error into a 500; once the deadline was hit that becomes the 504
+    async def app(scope, receive, send):
+        current_deadline.get().expire()
+        await respond(send, status=500)
+
+    sent = run_request(app)
+    assert [message.get("status") for message in sent if message["type"] == "http.response.start"] == [504]
+
+def test_client_disconnect_cancels_request_without_response():
+    cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        await respond(send)
+
+    sent = run_request(app, budget_ms=5000, disconnect_after=0.05)
+    assert sent == []
+    assert cancelled.is_set()
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+
+from loop_monitor import LoopWatchdog, BlockingCallError, MAX_KEPT_VIOLATIONS
+
+THRESHOLD_SECONDS = 0.1
+
+def run_with_watchdog(scenario, strict=False):
+    async def main():
+        monitor = LoopWatchdog(threshold=THRESHOLD_SECONDS, strict=strict)
+        await monitor.start()
+        try:
+            await scenario(monitor)
+        finally:
+            if not strict:
+                await monitor.stop()
+        return monitor
+    return asyncio.run(main())
+
+def test_budget_fails_on_blocking_call():
+    async def scenario(monitor):
+        with pytest.raises(BlockingCallError, match=r"time\.sleep"):
+            async with monitor.budget():
+                time.sleep(THRESHOLD_SECONDS * 3)
+    run_with_watchdog(scenario)
+
+def test_budget_allows_awaiting():
+    async def scenario(monitor):
+        async with monitor.budget():
+            await asyncio.sleep(THRESHOLD_SECONDS * 3)
+    run_with_watchdog(scenario)
+
+def test_budget_only_counts_its_own_block():
+    async def scenario(monitor):
+        time.sleep(THRESHOLD_SECONDS * 3)
+        await asyncio.sleep(THRESHOLD_SECONDS)
+        async with monitor.budget():
+            await asyncio.sleep(THRESHOLD_SECONDS)
+    monitor = run_with_watchdog(scenario)
+    assert monitor.violation_count == 1
+
+def test_strict_mode_fails_on_stop():
+    async def scenario(monitor):
+        time.sleep(THRESHOLD_SECONDS * 3)
+        await asyncio.sleep(THRESHOLD_SECONDS)
+        with pytest.raises(BlockingCallError):
+            await monitor.stop()
+    run_with_watchdog(scenario, strict=True)
+
+def test_kept_violations_are_capped_outside_strict_mode():
+    monitor = LoopWatchdog(threshold=THRESHOLD_SECONDS)
+    for _ in range(MAX_KEPT_VIOLATIONS + 5):
+        monitor.record_blocking(THRESHOLD_SECONDS * 2)
+    assert len(monitor.violations) == MAX_KEPT_VIOLATIONS
+    assert monitor.violation_count == MAX_KEPT_VIOLATIONS + 5
+    with pytest.raises(BlockingCallError):
+        monitor.raise_for_violations(since=MAX_KEPT_VIOLATIONS)
@@ -7,7 +7,7 @@ import { useRouter } from 'next/router';
 export default function Calendar() {
   const router = useRouter();
   const [currentDate, setCurrentDate] = useState(new Date());
-  const [tasks, setTasks] = useState([]);
+  const [days, setDays] = useState([]);
   const [userId, setUserId] = useState(null);
 
   useEffect(() => {
@@ -18,85 +18,53 @@ export default function Calendar() {
       localStorage.setItem('user_id', router.query.user_id);
     }
     setUserId(storedUserId);
-
-    if (storedUserId) {
-      fetchTasks(storedUserId);
-    }
   }, [router.query.user_id]);
 
-  // Fetch tasks for the user
-  const fetchTasks = async (userId) => {
-    try {
-      const response = await axios.get(`http://localhost:8000/api/tasks/fetch/${userId}`);
-      const fetchedTasks = response.data.map(task => ({
-        task_id: task.task_id,
-        title: task.title,
-        due_date: task.due_date,
-        description: task.description,
-        status: task.status
-      }));
-      setTasks(fetchedTasks);
-
-      // Create calendar entries for fetched tasks only if they don't already exist
-      await Promise.all(fetchedTasks.map(task => checkAndCreateCalendarEntry(userId, task.task_id)));
-    } catch (error) {
-      console.error('Error fetching tasks:', error);
+  useEffect(() => {
+    if (userId) {
+      fetchMonth(userId, currentDate.getFullYear(), currentDate.getMonth() + 1);
     }
-  };
+  }, [userId, currentDate]);
 
-  // Check if calendar entry exists, if not create it
-  const checkAndCreateCalendarEntry = async (userId, taskId) => {
+  // Fetch the displayed month as day buckets (only the tasks due in this month are sent)
+  const fetchMonth = async (userId, year, month) => {
     try {
-      // Check if the calendar entry already exists
-      await axios.get(`http://localhost:8000/api/calendar/${userId}`);
+      const response = await axios.get(`http://localhost:8000/api/calendar/month/${userId}`, {
+        params: { year, month }
+      });
+      setDays(response.data.days);
     } catch (error) {
-      if (error.response && error.response.status === 404) {
-        // Entry not found, so create it
-        await axios.post('http://localhost:8000/api/calendar', { user_id: userId, task_id: taskId });
-        console.log(`Created calendar entry for task ID: ${taskId}`);
-      } else {
-        console.error('Error checking/creating calendar entry:', error);
-      }
+      console.error('Error fetching calendar month:', error);
     }
   };
 
   // Render the days of the calendar with tasks
   const renderDays = () => {
-    const days = [];
+    const cells = [];
     const firstDayIndex = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1).getDay();
-    const lastDay = new Date(currentDate.getFullYear(), currentDate.getMonth() + 1, 0).getDate();
 
     // Adding blank days for previous month
     for (let i = 0; i < firstDayIndex; i++) {
-      days.push(<div key={`empty-${i}`} className={styles.inactiveDay}></div>);
+      cells.push(<div key={`empty-${i}`} className={styles.inactiveDay}></div>);
     }
 
-    // Adding days of current month with tasks
-    for (let i = 1; i <= lastDay; i++) {
-      const dayTasks = tasks.filter(task => {
-        const taskDate = new Date(task.due_date);
-        return (
-          taskDate.getDate() === i &&
-          taskDate.getMonth() === currentDate.getMonth() &&
-          taskDate.getFullYear() === currentDate.getFullYear()
-        );
-      });
-
-      days.push(
-        <div key={i} className={styles.day}>
-          <span className={styles.dayNumber}>{i}</span>
+    // Adding days of current month with their pre-bucketed tasks
+    days.forEach((day, index) => {
+      cells.push(
+        <div key={day.day} className={styles.day}>
+          <span className={styles.dayNumber}>{index + 1}</span>
           <div className={styles.taskContainer}>
-            {dayTasks.map((task, index) => (
-              <div key={index} className={styles.taskBox}>
+            {day.tasks.map((task) => (
+              <div key={task.task_id} className={styles.taskBox}>
                 {task.title}
               </div>
             ))}
           </div>
         </div>
       );
-    }
+    });
 
-    return days;
+    return cells;
   };
 
   const handlePrevMonth = () => {